@@ -11,6 +11,7 @@ output data:
 import pandas as pd
 from functions.process_microcensus import *
 from functions.commonFunctions import *
+from functions.microcensus_loader import load_microcensus
 import warnings
 pd.set_option('display.max_columns', None)
 
@@ -28,7 +29,11 @@ def execute_person(path):
     # Read the "zielpersonen.csv" data from the microzensus folder
     file_path_Ziel = os.path.join(path, "microzensus", "zielpersonen.csv")
     print(f"Constructed file path: {file_path_Ziel}")
-    df_mz_persons = pd.read_csv(file_path_Ziel, sep=",", encoding="latin1", parse_dates=["USTag"])
+    df_mz_persons = load_microcensus(os.path.join(path, "microzensus"), "zielpersonen.csv", [
+        "HHNR", "alter", "gesl", "WP", "USTag", "zivil", "f20400a", "f42100e", "f40800_01", "tag",
+        "f41610a", "f41610b", "f41610c", "f41610d", "f41610e", "f41610f", "f41610g",
+        "f41651", "f41653", "f41654", "HAUSB", "f41300", "f41301", "f41400", "f41401"
+    ], parse_dates=["USTag"])
 
     df_mz_persons["age"] = df_mz_persons["alter"]
     df_mz_persons["sex"] = df_mz_persons["gesl"] - 1  # Make zero-based
@@ -38,22 +43,14 @@ def execute_person(path):
 
     # Convert Marital Status to a categorical variable (0: Single, 1: Married, 2: Separated)
     # Marital status
-    df_mz_persons.loc[df_mz_persons["zivil"] == 1, "marital_status"] = c.MARITAL_STATUS_SINGLE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 2, "marital_status"] = c.MARITAL_STATUS_MARRIED
-    df_mz_persons.loc[df_mz_persons["zivil"] == 3, "marital_status"] = c.MARITAL_STATUS_SEPARATE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 4, "marital_status"] = c.MARITAL_STATUS_SEPARATE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 5, "marital_status"] = c.MARITAL_STATUS_SINGLE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 6, "marital_status"] = c.MARITAL_STATUS_MARRIED
-    df_mz_persons.loc[df_mz_persons["zivil"] == 7, "marital_status"] = c.MARITAL_STATUS_SEPARATE
+    df_mz_persons["marital_status"] = recode(df_mz_persons["zivil"], c.ZIVIL_TO_MARITAL_STATUS)
 
     # Put the driving license equal to True if the person has a driving license
     df_mz_persons["driving_license"] = df_mz_persons["f20400a"] == 1
 
     # Convert the car availability to a categorical variable (0: Always, 1: Sometimes, 2: Never)
-    df_mz_persons["car_availability"] = c.CAR_AVAILABILITY_NEVER
-    df_mz_persons.loc[df_mz_persons["f42100e"] == 1, "car_availability"] = c.CAR_AVAILABILITY_ALWAYS
-    df_mz_persons.loc[df_mz_persons["f42100e"] == 2, "car_availability"] = c.CAR_AVAILABILITY_SOMETIMES
-    df_mz_persons.loc[df_mz_persons["f42100e"] == 3, "car_availability"] = c.CAR_AVAILABILITY_NEVER
+    df_mz_persons["car_availability"] = recode(df_mz_persons["f42100e"], c.F42100E_TO_CAR_AVAILABILITY,
+                                               default=c.CAR_AVAILABILITY_NEVER)
 
     # Set the employed column equal to True if the person is employed
     # Employment (TODO: I know that LIMA uses a more fine-grained category here)
@@ -67,9 +64,7 @@ def execute_person(path):
 
     # Day of the observation
     # When the tag is 6 or 7, it is a weekend
-    df_mz_persons["weekend"] = False
-    df_mz_persons.loc[df_mz_persons["tag"] == 6, "weekend"] = True
-    df_mz_persons.loc[df_mz_persons["tag"] == 7, "weekend"] = True
+    df_mz_persons["weekend"] = recode(df_mz_persons["tag"], c.TAG_TO_WEEKEND, default=False)
 
     # Here we extract a bit more than Kirill, but most likely it will be useful later
     df_mz_persons["subscriptions_ga"] = df_mz_persons["f41610a"] == 1
@@ -85,25 +80,11 @@ def execute_person(path):
     df_mz_persons["subscriptions_strecke_class"] = df_mz_persons["f41654"] == 1
 
     # Education
-    df_mz_persons["highest_education"] = np.nan
-    df_mz_persons.loc[df_mz_persons["HAUSB"].isin([1, 2, 3, 4]), "highest_education"] = "primary"
-    df_mz_persons.loc[df_mz_persons["HAUSB"].isin([5, 6, 7, 8, 9, 10, 11, 12]), "highest_education"] = "secondary"
-    df_mz_persons.loc[df_mz_persons["HAUSB"].isin([13, 14, 15, 16]), "highest_education"] = "tertiary_professional"
-    df_mz_persons.loc[df_mz_persons["HAUSB"].isin([17, 18, 19]), "highest_education"] = "tertiary_academic"
-    df_mz_persons["highest_education"] = df_mz_persons["highest_education"].astype("category")
+    df_mz_persons["highest_education"] = recode(df_mz_persons["HAUSB"], c.HAUSB_TO_EDUCATION, categorical=True)
 
     # Parking
-    df_mz_persons["parking_work"] = "unknown"
-    df_mz_persons.loc[df_mz_persons["f41300"] == 1, "parking_work"] = "free"
-    df_mz_persons.loc[df_mz_persons["f41300"] == 2, "parking_work"] = "paid"
-    df_mz_persons.loc[df_mz_persons["f41300"] == 3, "parking_work"] = "no"
-    df_mz_persons["parking_work"] = df_mz_persons["parking_work"].astype("category")
-
-    df_mz_persons["parking_education"] = "unknown"
-    df_mz_persons.loc[df_mz_persons["f41301"] == 1, "parking_education"] = "free"
-    df_mz_persons.loc[df_mz_persons["f41301"] == 2, "parking_education"] = "paid"
-    df_mz_persons.loc[df_mz_persons["f41301"] == 3, "parking_education"] = "no"
-    df_mz_persons["parking_education"] = df_mz_persons["parking_education"].astype("category")
+    df_mz_persons["parking_work"] = recode(df_mz_persons["f41300"], c.PARKING_TYPES, default="unknown", categorical=True)
+    df_mz_persons["parking_education"] = recode(df_mz_persons["f41301"], c.PARKING_TYPES, default="unknown", categorical=True)
 
     df_mz_persons["parking_cost_work"] = np.maximum(0, df_mz_persons["f41400"].astype(float))
     df_mz_persons["parking_cost_education"] = np.maximum(0, df_mz_persons["f41401"].astype(float))
@@ -136,8 +117,10 @@ def execute_person(path):
 
 
 def execute_household(path):
-    file_path_Haushalte = os.path.join(path, "microzensus", "haushalte.csv")
-    df_mz_households = pd.read_csv(file_path_Haushalte, sep=",", encoding="latin1")
+    df_mz_households = load_microcensus(os.path.join(path, "microzensus"), "haushalte.csv", [
+        "HHNR", "WM", "W_STRUKTUR_AGG_2000", "hhgr", "f30100", "f32200a", "F20601",
+        "W_X_CH1903", "W_Y_CH1903", "W_KANTON"
+    ])
 
     # Simple attributes
     df_mz_households["home_structure"] = df_mz_households["W_STRUKTUR_AGG_2000"]
@@ -151,12 +134,11 @@ def execute_household(path):
     df_mz_households["income_class"] = df_mz_households["F20601"] - 1  # Turn into zero-based class
     df_mz_households["income_class"] = np.maximum(-1, df_mz_households["income_class"])  # Make all "invalid" entries -1
 
-    # Convert coordinates to LV95
-    coords = df_mz_households[["W_X_CH1903", "W_Y_CH1903"]].values
-    transformer = pyproj.Transformer.from_crs(c.CH1903, c.CH1903_PLUS)
-    x, y = transformer.transform(coords[:, 0], coords[:, 1])
-    df_mz_households.loc[:, "home_x"] = x
-    df_mz_households.loc[:, "home_y"] = y
+    # Convert coordinates to LV95 (cached next to haushalte.csv)
+    projected = project_to_lv95(df_mz_households, {"home": ("W_X_CH1903", "W_Y_CH1903")},
+                                cache_file=os.path.join(path, "microzensus", "haushalte_lv95.npz"))
+    df_mz_households.loc[:, "home_x"] = projected["home_x"]
+    df_mz_households.loc[:, "home_y"] = projected["home_y"]
 
     # Class variable for number of cars
     df_mz_households["number_of_cars_class"] = 0
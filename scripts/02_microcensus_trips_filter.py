@@ -16,13 +16,19 @@ Output data:
 import logging
 
 # Import necessary libraries
-import pyproj
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import geopandas as gpd
-from shapely.geometry import Point
+import shapely
 from functions.commonFunctions import *
+from functions.spatial_filter import trips_inside_masks
+from functions.process_microcensus import project_to_lv95, recode
+from functions.microcensus_loader import load_microcensus
+from functions.activity_chains import activity_chains
+from functions.person_sequences import PersonLayout, activity_durations
+from functions.time_bins import binned_times
+from functions.microcensusConstants import WMITTEL_TO_MODE, WMITTEL_TO_MODE_DETAILED, WZWECK1_TO_PURPOSE
 import warnings
 pd.set_option('display.max_columns', 100)
 pd.set_option('display.max_rows', 100)
@@ -43,48 +49,22 @@ def get_log_filename():
     return log_filename
 
 def execute(path):
-    # Specify encoding
-    encoding = "latin1"
-
-    file_path = os.path.join(path, "microzensus", "wege.csv")
-    df_mz_trips = pd.read_csv(file_path, encoding=encoding) 
-    file_path = os.path.join(path, "microzensus", "etappen.csv")
-    df_mz_stages = pd.read_csv(file_path, encoding=encoding)
-    print(df_mz_trips.shape)
-
-    df_mz_trips = df_mz_trips[[
+    # Only the used columns are parsed, and cached for the next runs (functions/microcensus_loader.py)
+    microcensus_path = os.path.join(path, "microzensus")
+    df_mz_trips = load_microcensus(microcensus_path, "wege.csv", [
         "HHNR", "WEGNR", "f51100", "f51400", "wzweck1", "wzweck2", "wmittel",
         "S_X_CH1903", "S_Y_CH1903", "Z_X_CH1903", "Z_Y_CH1903", "W_X_CH1903", "W_Y_CH1903",
         "w_rdist", 'dauer2'
-    ]]
-
-    df_mz_stages = df_mz_stages[[
-        "HHNR", "WEGNR", "ETNR", "f51300"
-    ]]
+    ])
+    # The stages are read once, for the passengers and for the parking cost
+    df_mz_stages = load_microcensus(microcensus_path, "etappen.csv", [
+        "HHNR", "WEGNR", "ETNR", "f51300", "f51330"
+    ])
+    print(df_mz_trips.shape)
 
     # First, adjust the modes
-    df_mz_trips.loc[df_mz_trips["wmittel"] == -99, "mode"] = "unknown"  # Pseudo stage
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 1, "mode"] = "pt"  # Plane
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 2, "mode"] = "pt"  # Train
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 3, "mode"] = "pt"  # Postauto
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 4, "mode"] = "pt"  # Ship
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 5, "mode"] = "pt"  # Tram
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 6, "mode"] = "pt"  # Bus
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 7, "mode"] = "pt"  # other PT
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 8, "mode"] = "pt"  # Reisecar -> I think this is a coach in Swiss German?
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 9, "mode"] = "car"  # Car
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 10, "mode"] = "car"  # Truck
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 11, "mode"] = "pt"  # Taxi
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 12, "mode"] = "car"  # Motorbike
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 13, "mode"] = "car"  # Mofa
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 14, "mode"] = "bike"  # Bicycle / E-bike
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 15, "mode"] = "walk"  # Walking
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 16, "mode"] = "car"  # "Machines similar to a vehicle"
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 17, "mode"] = "unknown"  # Other / don't know
-
-    df_mz_trips["mode_detailed"] = df_mz_trips["mode"]
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 1, "mode_detailed"] = "plane"
-    df_mz_trips.loc[df_mz_trips["wmittel"] == 11, "mode_detailed"] = "taxi"
+    df_mz_trips["mode"] = recode(df_mz_trips["wmittel"], WMITTEL_TO_MODE)
+    df_mz_trips["mode_detailed"] = recode(df_mz_trips["wmittel"], WMITTEL_TO_MODE_DETAILED)
 
     # Find passenger trips
     df_mz_stages["is_car_passenger"] = df_mz_stages["f51300"] == 8
@@ -95,22 +75,7 @@ def execute(path):
     del df_mz_trips["is_car_passenger"]
 
     # Second, adjust the purposes
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == -99, "purpose"] = "unknown"  # Pseudo stage
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == -98, "purpose"] = "unknown"  # No answer
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == -97, "purpose"] = "unknown"  # Don't know
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 1, "purpose"] = "interaction"  # Transfer, change of mode, park car
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 2, "purpose"] = "work"  # Work
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 3, "purpose"] = "education"  # Education
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 4, "purpose"] = "shop"  # Shopping
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 5, "purpose"] = "other"  # Chores, use of public services
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 6, "purpose"] = "work"  # Business activity
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 7, "purpose"] = "work"  # Business trip
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 8, "purpose"] = "leisure"  # Leisure
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 9, "purpose"] = "other"  # Bring children
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 10, "purpose"] = "other"  # Bring others (disabled, ...)
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 11, "purpose"] = "home"  # Return home
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 12, "purpose"] = "unknown"  # Other
-    df_mz_trips.loc[df_mz_trips["wzweck1"] == 13, "purpose"] = "border"  # Going out of country
+    df_mz_trips["purpose"] = recode(df_mz_trips["wzweck1"], WZWECK1_TO_PURPOSE)
 
     # Adjust trips back home
     df_mz_trips.loc[df_mz_trips["wzweck2"] > 1, "purpose"] = "home"
@@ -123,13 +88,14 @@ def execute(path):
     df_mz_trips.loc[:, "person_id"] = df_mz_trips["HHNR"]
     df_mz_trips.loc[:, "trip_id"] = df_mz_trips["WEGNR"]
 
-    # Adjust coordinates
-    for mz_attribute, df_attribute in [("Z", "destination"), ("S", "origin"), ("W", "home")]:
-        coords = df_mz_trips[["%s_X_CH1903" % mz_attribute, "%s_Y_CH1903" % mz_attribute]].values
-        transformer = pyproj.Transformer.from_crs("epsg:21781", "epsg:2056")  # Correct CRS codes for CH1903 to CH1903+
-        x, y = transformer.transform(coords[:, 0], coords[:, 1])
-        df_mz_trips.loc[:, "%s_x" % df_attribute] = x
-        df_mz_trips.loc[:, "%s_y" % df_attribute] = y
+    # Adjust coordinates (CH1903 to CH1903+, cached next to wege.csv)
+    projected = project_to_lv95(df_mz_trips, {
+        "destination": ("Z_X_CH1903", "Z_Y_CH1903"),
+        "origin": ("S_X_CH1903", "S_Y_CH1903"),
+        "home": ("W_X_CH1903", "W_Y_CH1903"),
+    }, cache_file=os.path.join(path, "microzensus", "wege_lv95.npz"))
+    for column, values in projected.items():
+        df_mz_trips.loc[:, column] = values
 
         # Add crowfly distance
     df_mz_trips.loc[:, "crowfly_distance"] = np.sqrt(
@@ -137,22 +103,18 @@ def execute(path):
         (df_mz_trips["origin_y"] - df_mz_trips["destination_y"]) ** 2
     )
 
-    # Add activity durations by joining the trips with themselves
-    df_mz_trips.loc[:, "previous_trip_id"] = df_mz_trips["trip_id"] - 1
-
-    df_durations = pd.merge(
-        df_mz_trips[["person_id", "trip_id", "departure_time"]],
-        df_mz_trips[["person_id", "previous_trip_id", "arrival_time"]],
-        left_on=["person_id", "trip_id"], right_on=["person_id", "previous_trip_id"]
-    )
-    print(df_durations.shape)
+    # Trips sorted once by person and trip, for the activity durations and the first/last trip checks
+    trips_layout = PersonLayout(df_mz_trips["person_id"], order_by=df_mz_trips["trip_id"])
 
-    df_durations.loc[:, "activity_duration"] = df_durations["arrival_time"] - df_durations["departure_time"]
+    # Add activity durations from the next trip of the same person (no self-merge)
+    df_mz_trips.loc[:, "previous_trip_id"] = df_mz_trips["trip_id"] - 1
+    df_mz_trips.loc[:, "activity_duration"] = activity_durations(df_mz_trips, layout=trips_layout)
 
-    df_mz_trips = pd.merge(
-        df_mz_trips, df_durations[["person_id", "trip_id", "activity_duration"]],
-        on=["person_id", "trip_id"], how="left"
-    )
+    # Last purpose and first trip of each person
+    last_purpose = trips_layout.last(df_mz_trips["purpose"])
+    first_trip_id = trips_layout.first(df_mz_trips["trip_id"])
+    starts_away_from_home = ((trips_layout.first(df_mz_trips["origin_x"]) != trips_layout.first(df_mz_trips["home_x"])) |
+                             (trips_layout.first(df_mz_trips["origin_y"]) != trips_layout.first(df_mz_trips["home_y"])))
 
     # 1217 trips remove
     # Filter persons for which we do not have sufficient information
@@ -169,29 +131,16 @@ def execute(path):
     df_mz_trips = df_mz_trips[~df_mz_trips["person_id"].isin(unknown_ids)]
 
     # Filter persons which do not start or end with "home"
-    df_end = df_mz_trips[["person_id", "trip_id", "purpose"]].sort_values("trip_id", ascending=False).drop_duplicates(
-        "person_id")
-    df_end = df_end[df_end["purpose"] != "home"]
-
-    before_length = len(np.unique(df_mz_trips["person_id"]))
-    df_mz_trips = df_mz_trips[~df_mz_trips["person_id"].isin(df_end["person_id"])]
-    after_length = len(np.unique(df_mz_trips["person_id"]))
-    print("  Removed %d persons with trips not ending with 'home'" % (before_length - after_length,))
-
-    df_start = df_mz_trips[["person_id", "trip_id", "origin_x", "origin_y", "home_x", "home_y"]]
-    df_start = df_start[
-        (df_start["trip_id"] == 1) & ((df_start["origin_x"] != df_start["home_x"]) |
-                                      (df_start["origin_y"] != df_start["home_y"]))
-        ]
-
-    before_length = len(np.unique(df_mz_trips["person_id"]))
-    df_mz_trips = df_mz_trips[~df_mz_trips["person_id"].isin(df_start["person_id"])]
-    after_length = len(np.unique(df_mz_trips["person_id"]))
-    print("  Removed %d persons with trips not starting at home location" % (before_length - after_length,))
+    known_persons = ~trips_layout.persons.isin(unknown_ids)
+    not_ending_home = known_persons & (last_purpose != "home")
+    df_mz_trips = df_mz_trips[~df_mz_trips["person_id"].isin(trips_layout.persons[not_ending_home])]
+    print("  Removed %d persons with trips not ending with 'home'" % (not_ending_home.sum(),))
 
-    # Parking cost
-    df_mz_stages = pd.read_csv(os.path.join(path, "microzensus", "etappen.csv"), encoding="latin1")
+    not_starting_home = known_persons & ~not_ending_home & (first_trip_id == 1) & starts_away_from_home
+    df_mz_trips = df_mz_trips[~df_mz_trips["person_id"].isin(trips_layout.persons[not_starting_home])]
+    print("  Removed %d persons with trips not starting at home location" % (not_starting_home.sum(),))
 
+    # Parking cost
     df_cost = pd.DataFrame(df_mz_stages[["HHNR", "WEGNR", "f51330"]], copy=True)
     df_cost.columns = ["person_id", "trip_id", "parking_cost"]
     df_cost["parking_cost"] = np.maximum(0, df_cost["parking_cost"])
@@ -206,12 +155,6 @@ def execute(path):
     return df_mz_trips
 
 
-def create_activity_chain(group):
-    chain = '-'.join(
-        ['h'] + [purpose[0] for purpose in group['purpose'].tolist()])  # Add 'H' at the start of each chain
-    return pd.Series({'activity_chain': chain})
-
-
 if __name__ == '__main__':
     setup_logging(get_log_filename())
 
@@ -233,19 +176,21 @@ if __name__ == '__main__':
         area_polygon = gdf.iloc[0]['geometry']
         logging.info("Shapefile loaded successfully and area_polygon created successfully")
 
-        # Create Point geometries for origin and destination
-        trips['origin_point'] = trips.apply(lambda row: Point(row['origin_x'], row['origin_y']), axis=1)
-        trips['destination_point'] = trips.apply(lambda row: Point(row['destination_x'], row['destination_y']), axis=1)
+        # Origin and destination inside the polygon, tested once per endpoint on the coordinate arrays
+        # and reused for the O and D filter, the O or D filter and the ids below
+        origin_inside, destination_inside = trips_inside_masks(area_polygon, trips, ('origin_x', 'origin_y'), ('destination_x', 'destination_y'))
+        inside = origin_inside & destination_inside
+
+        # Point geometries for origin and destination, kept in the output files
+        trips['origin_point'] = shapely.points(trips['origin_x'].to_numpy(), trips['origin_y'].to_numpy())
+        trips['destination_point'] = shapely.points(trips['destination_x'].to_numpy(), trips['destination_y'].to_numpy())
 
         # Filter trips where both origin and destination are within the given city polygon shapefile
-        filtered_trips_inside = trips[
-            trips['origin_point'].apply(lambda point: point.within(area_polygon)) &
-            trips['destination_point'].apply(lambda point: point.within(area_polygon))
-            ]
+        filtered_trips_inside = trips[inside]
 
         logging.info("Trips filtered successfully based on the shapefile polygon successfully")
 
-        rest_of_trips = trips.drop(filtered_trips_inside.index)
+        rest_of_trips = trips[~inside]
 
         # The ids of the people who have trips inside the area
         ids_inside = set(filtered_trips_inside['person_id'])
@@ -258,15 +203,12 @@ if __name__ == '__main__':
 
         filtered_trips_inside.to_csv(os.path.join(analysis_zone_path, "microzensus", "trips_inside_O_and_D_Mic.csv"))
 
-        filtered_trips_inside_outside = trips[
-            trips['origin_point'].apply(lambda point: point.within(area_polygon)) |
-            trips['destination_point'].apply(lambda point: point.within(area_polygon))
-            ]
+        filtered_trips_inside_outside = trips[origin_inside | destination_inside]
 
         filtered_trips_inside_outside.to_csv(os.path.join(analysis_zone_path, "microzensus", "trips_inside_O_or_D_Mic.csv"), index=False)
 
         # Create activity chains
-        df_activity_chains = filtered_trips_inside.groupby(['person_id']).apply(create_activity_chain).reset_index()
+        df_activity_chains = activity_chains(filtered_trips_inside, 'person_id', 'purpose', prefix='h')
 
         all_population = pd.read_csv(os.path.join(analysis_zone_path, "microzensus", "all_population.csv"))
         # Recreate population_home_inside.csv if want to analyse w home inside
@@ -306,12 +248,12 @@ if __name__ == '__main__':
         # Calculate percentage distribution for each mode
         mode_counts['Percentage'] = (mode_counts['Count'] / mode_counts['Count'].sum()) * 100
 
-        # Convert seconds to datetime and resample times to 15-minute bins
-        filtered_trips_inside['departure_time'] = pd.to_datetime(filtered_trips_inside['departure_time'], unit='s').dt.floor('30T').dt.time
-        filtered_trips_inside['arrival_time'] = pd.to_datetime(filtered_trips_inside['arrival_time'], unit='s').dt.floor('30T').dt.time
+        # Bin the times (seconds) into 30-minute bins
+        filtered_trips_inside['departure_time'] = binned_times(filtered_trips_inside['departure_time'])
+        filtered_trips_inside['arrival_time'] = binned_times(filtered_trips_inside['arrival_time'])
         logging.info("The departure and arrival times are converted to datetime and resampled into bins successfully")
 
-        # Count occurrences in each 15-minute bin
+        # Count occurrences in each 30-minute bin
         departure_counts = filtered_trips_inside.groupby('departure_time').size().reset_index(name='Count')
         departure_counts['Type'] = 'Departures'
         departure_counts = departure_counts.rename(columns={'departure_time': 'Time'})
@@ -1,6 +1,8 @@
 # Import necessary libraries
 import matsim
 from functions.commonFunctions import *
+from functions.intermediate_store import write_table
+from functions.stream_plans import stream_plans_to_csv, DEFAULT_CHUNK_SIZE
 import pandas as pd
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
@@ -14,35 +16,18 @@ if __name__ == '__main__':
     scenario_path: str = os.path.join(data_path, simulation_zone_name, scenario, percentile)
     output_folder_path: str = os.path.join(data_path, simulation_zone_name, sim_output_folder)
 
-    # Read the XML data with a matsim library
-    try:
-        plans_sim = matsim.plan_reader_dataframe(os.path.join(output_folder_path, "output_plans.xml.gz"))
-        logging.info("Output plans data loaded successfully")
-
-        if read_SynPop:
-            households_synt = matsim.household_reader(os.path.join(scenario_path, "households.xml.gz")) # dataframe types conversion failed
-            logging.info("Synthetic Household data loaded successfully")
-            plans = matsim.plan_reader_dataframe(os.path.join(scenario_path, f"population.xml.gz"))
-            logging.info("Synthetic Population data loaded successfully")
-
-    except Exception as e:
-        logging.error("Error loading data: " + str(e))
-        sys.exit()
-
-    # Create the separated dataframe files of the loaded data
-    try:
-        df_activity_sim = plans_sim.activities
-
-        if read_SynPop:
-            df_activity_synt = plans.activities
-            df_persons_synt = plans.persons
-            df_routes_synt = plans.routes
-            df_households_synt = households_synt.households
-
-        logging.info("Dataframes created successfully")
-    except Exception as e:
-        logging.error("Error creating dataframes: " + str(e))
-        sys.exit()
+    config = load_config()
+    stream_plans = config.getboolean('config', 'stream_plans', fallback=False)
+    plans_chunk_size = config.getint('config', 'plans_chunk_size', fallback=DEFAULT_CHUNK_SIZE)
+    # Parse-time filters: the skipped plans are never turned into rows (they are filtered anyway in 05_1)
+    plans_filters = {
+        'selected_plans_only': config.getboolean('config', 'plans_selected_only', fallback=False),
+        'skip_freight': config.getboolean('config', 'plans_skip_freight', fallback=False),
+        'skip_plans_with_activity_types': ['outside'] if config.getboolean('config', 'plans_skip_outside', fallback=False) else [],
+    }
+    if any(plans_filters.values()) and not stream_plans:
+        logging.info("Parse-time plans filters are applied by the streaming reader, stream_plans enabled")
+        stream_plans = True
 
     pre_processed_data_path = os.path.join(data_path, analysis_zone_name, csv_folder, percentile)
     # Create the directory for the csv files is not exists
@@ -50,18 +35,72 @@ if __name__ == '__main__':
         os.makedirs(pre_processed_data_path)
         logging.info("Directory for csv files created successfully")
 
-    # Create the csv files from the dataframes
-    try:
-        df_activity_sim.to_csv(os.path.join(pre_processed_data_path, "df_activity_sim.csv"), index=False)
+    if stream_plans:
+        # Write the plans straight to the csv files in chunks, the plans are never fully loaded in memory
+        try:
+            stream_plans_to_csv(os.path.join(output_folder_path, "output_plans.xml.gz"),
+                                {'activities': os.path.join(pre_processed_data_path, "df_activity_sim.csv")},
+                                chunk_size=plans_chunk_size, **plans_filters)
+            logging.info("Output plans data streamed to csv successfully")
+
+            if read_SynPop:
+                households_synt = matsim.household_reader(os.path.join(scenario_path, "households.xml.gz"))
+                write_table(households_synt.households, os.path.join(pre_processed_data_path, "df_households_synt.csv"))
+                logging.info("Synthetic Household data loaded successfully")
+                stream_plans_to_csv(os.path.join(scenario_path, "population.xml.gz"),
+                                    {'activities': os.path.join(pre_processed_data_path, "df_activity_synt.csv"),
+                                     'persons': os.path.join(pre_processed_data_path, "df_persons_synt.csv"),
+                                     'routes': os.path.join(pre_processed_data_path, "df_routes_synt.csv")},
+                                    chunk_size=plans_chunk_size, **plans_filters)
+                logging.info("Synthetic Population data streamed to csv successfully")
+
+            logging.info("All the csv files created successfully")
+        except Exception as e:
+            logging.error("Error streaming plans data to csv files: " + str(e))
+            sys.exit()
+    else:
+        # Read the XML data with a matsim library
+        try:
+            plans_sim = matsim.plan_reader_dataframe(os.path.join(output_folder_path, "output_plans.xml.gz"))
+            logging.info("Output plans data loaded successfully")
+
+            if read_SynPop:
+                households_synt = matsim.household_reader(os.path.join(scenario_path, "households.xml.gz")) # dataframe types conversion failed
+                logging.info("Synthetic Household data loaded successfully")
+                plans = matsim.plan_reader_dataframe(os.path.join(scenario_path, f"population.xml.gz"))
+                logging.info("Synthetic Population data loaded successfully")
+
+        except Exception as e:
+            logging.error("Error loading data: " + str(e))
+            sys.exit()
+
+        # Create the separated dataframe files of the loaded data
+        try:
+            df_activity_sim = plans_sim.activities
+
+            if read_SynPop:
+                df_activity_synt = plans.activities
+                df_persons_synt = plans.persons
+                df_routes_synt = plans.routes
+                df_households_synt = households_synt.households
+
+            logging.info("Dataframes created successfully")
+        except Exception as e:
+            logging.error("Error creating dataframes: " + str(e))
+            sys.exit()
+
+        # Create the csv files from the dataframes
+        try:
+            write_table(df_activity_sim, os.path.join(pre_processed_data_path, "df_activity_sim.csv"))
 
-        if read_SynPop:
-            df_activity_synt.to_csv(os.path.join(pre_processed_data_path, "df_activity_synt.csv"), index=False)
-            df_persons_synt.to_csv(os.path.join(pre_processed_data_path, "df_persons_synt.csv"), index=False)
-            df_routes_synt.to_csv(os.path.join(pre_processed_data_path, "df_routes_synt.csv"), index=False)
-            df_households_synt.to_csv(os.path.join(pre_processed_data_path, "df_households_synt.csv"), index=False)
+            if read_SynPop:
+                write_table(df_activity_synt, os.path.join(pre_processed_data_path, "df_activity_synt.csv"))
+                write_table(df_persons_synt, os.path.join(pre_processed_data_path, "df_persons_synt.csv"))
+                write_table(df_routes_synt, os.path.join(pre_processed_data_path, "df_routes_synt.csv"))
+                write_table(df_households_synt, os.path.join(pre_processed_data_path, "df_households_synt.csv"))
 
 
-        logging.info("All the csv files created successfully")
-    except Exception as e:
-        logging.error("Error creating csv files: " + str(e))
-        sys.exit()
+            logging.info("All the csv files created successfully")
+        except Exception as e:
+            logging.error("Error creating csv files: " + str(e))
+            sys.exit()
@@ -3,12 +3,177 @@ from random import sample
 
 import matsim
 import geopandas as gpd
-from shapely.geometry import Point
 from functions.commonFunctions import *
+from functions.spatial_filter import points_inside_areas, trips_inside_area_masks
+from functions.intermediate_store import open_chunked_writer
+from functions.trip_flags import (use_trip_flags, to_flags, FLAGS_COLUMN, FLAGGED_TRIPS, FLAGGED_PERSONS, O_AND_D, O_OR_D,
+                                  ALL_ACTIVITIES_INSIDE, AT_LEAST_ONE_ACTIVITY_INSIDE, HOME_INSIDE)
+from collections import defaultdict
+import numpy as np
 import pandas as pd
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 
+# Types of the output_trips columns used by the filters, the other columns are kept as strings.
+# The person ids are read as categorical (integer codes), freight agents do not have numeric ids.
+TRIPS_DTYPES = {
+    'person': 'category',
+    'start_x': 'float64',
+    'start_y': 'float64',
+    'end_x': 'float64',
+    'end_y': 'float64',
+    'longest_distance_mode': 'category',
+    'main_mode': 'category',
+}
+
+# Types of the output_persons columns used by the home filter, the other columns are kept as strings
+PERSONS_DTYPES = {
+    'person': 'category',
+    'home_x': 'float64',
+    'home_y': 'float64',
+}
+
+
+def read_output_chunks(file_path, chunk_size, nrows=None, dtype=str):
+    """Yield a gzipped MATSim output csv in chunks of chunk_size rows, or in one chunk if chunk_size is 0."""
+    read_options = dict(sep=';', low_memory=False, encoding='utf-8', dtype=dtype, compression='gzip', nrows=nrows)
+    if not chunk_size:
+        yield pd.read_csv(file_path, **read_options)
+    else:
+        yield from pd.read_csv(file_path, chunksize=chunk_size, **read_options)
+
+
+def read_trips_chunks(file_path, chunk_size, nrows=None):
+    """Yield the trips of output_trips.csv.gz without the outside and truck trips."""
+    for trips in read_output_chunks(file_path, chunk_size, nrows, dtype=defaultdict(lambda: str, TRIPS_DTYPES)):
+        yield trips[~trips['longest_distance_mode'].isin(['outside', 'truck'])]
+
+
+def load_areas(shapefile_folder, shape_file_name, analysis_areas):
+    """
+    Names and polygons of the analysis areas.
+    Without analysis_areas, the single area of shape_file_name (name None). Otherwise one area per
+    shapefile listed in analysis_areas (comma separated), a folder in the list adding all its shapefiles.
+    The areas are named after their shapefile (it names their output folder): two different shapefiles
+    with the same name raise a ValueError.
+    """
+    if not analysis_areas:
+        shapefile_paths = {None: os.path.join(shapefile_folder, shape_file_name)}
+    else:
+        shapefile_paths = {}
+        for name in [name.strip() for name in analysis_areas.split(',') if name.strip()]:
+            path = os.path.join(shapefile_folder, name)
+            paths = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith('.shp')] if os.path.isdir(path) else [path]
+            for shapefile_path in paths:
+                area_name = os.path.splitext(os.path.basename(shapefile_path))[0]
+                previous_path = shapefile_paths.get(area_name)
+                if previous_path is not None and os.path.normpath(previous_path) != os.path.normpath(shapefile_path):
+                    raise ValueError(f"Two analysis areas are named '{area_name}': {previous_path} and {shapefile_path}, "
+                                     f"their output files would overwrite each other. Rename one of the shapefiles")
+                shapefile_paths[area_name] = shapefile_path
+
+    areas = []
+    for name, shapefile_path in shapefile_paths.items():
+        gdf = gpd.read_file(shapefile_path, engine="pyogrio")
+        areas.append((name, gdf.iloc[0]['geometry']))
+    return areas
+
+
+class AreaOutputs:
+    """
+    Filters and output files of one analysis area. The chunks are given with the masks of the trips
+    (or homes) inside the area, computed once for all the areas.
+    """
+
+    def __init__(self, name, output_path, chunk_size, trip_flags, home_inside_filter):
+        self.name = name
+        self.output_path = output_path
+        self.chunk_size = chunk_size
+        self.trip_flags = trip_flags
+        self.home_inside_filter = home_inside_filter
+        self.writers = {}
+
+        # The ids of the people who have trips inside the area, who have trips outside the area
+        # and who have at least one trip with origin or destination inside the area
+        self.ids_inside, self.ids_rest, self.ids_O_or_D = set(), set(), set()
+        self.unique_ids = set()
+        self.persons_O_and_D, self.persons_O_or_D, self.persons_home_inside = set(), set(), set()
+
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+
+    def write(self, file_name, df):
+        if file_name not in self.writers:
+            self.writers[file_name] = open_chunked_writer(os.path.join(self.output_path, file_name), self.chunk_size)
+        self.writers[file_name].append_dataframe(df)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def add_trips(self, output_trips_sim, origin_inside, destination_inside):
+        # Filtered dataframe (O AND D inside)
+        inside = origin_inside & destination_inside
+        filtered_trips_inside = output_trips_sim[inside]
+        # Filtered dataframe (O OR D inside)
+        filtered_trips_inside_outside = output_trips_sim[origin_inside | destination_inside]
+
+        if not self.trip_flags:
+            self.write("trips_inside_O_and_D_sim.csv", filtered_trips_inside)
+            self.write("trips_inside_O_or_D_sim.csv", filtered_trips_inside_outside)
+
+        self.ids_inside.update(filtered_trips_inside['person'].unique())
+        self.ids_rest.update(output_trips_sim.loc[~inside, 'person'].unique())
+        self.ids_O_or_D.update(filtered_trips_inside_outside['person'].unique())
+
+    def finish_trips(self):
+        self.close()
+        # The ids of the people who have trips inside the area but not outside
+        self.unique_ids = self.ids_inside.difference(self.ids_rest)
+
+    def add_persons(self, df_persons_sim, home_inside):
+        all_activities_inside = df_persons_sim['person'].isin(self.unique_ids)
+        at_least_one_activity_inside = df_persons_sim['person'].isin(self.ids_O_or_D)
+        if home_inside is None:
+            home_inside = np.zeros(len(df_persons_sim), dtype=bool)
+
+        if self.trip_flags:
+            flags = to_flags({ALL_ACTIVITIES_INSIDE: all_activities_inside, AT_LEAST_ONE_ACTIVITY_INSIDE: at_least_one_activity_inside,
+                              HOME_INSIDE: home_inside})
+            self.write(FLAGGED_PERSONS, df_persons_sim.assign(**{FLAGS_COLUMN: flags})[flags != 0])
+        else:
+            self.write("population_all_activities_inside_sim.csv", df_persons_sim[all_activities_inside])
+            self.write("population_at_least_one_activity_inside_sim.csv", df_persons_sim[at_least_one_activity_inside])
+            if self.home_inside_filter:
+                self.write("population_home_inside_sim.csv", df_persons_sim[home_inside])
+
+        self.persons_O_and_D.update(df_persons_sim.loc[all_activities_inside, 'person'])
+        self.persons_O_or_D.update(df_persons_sim.loc[at_least_one_activity_inside, 'person'])
+        self.persons_home_inside.update(df_persons_sim.loc[home_inside, 'person'])
+
+    def add_person_trips(self, output_trips_sim, origin_inside=None, destination_inside=None):
+        all_activities_inside = output_trips_sim['person'].isin(self.persons_O_and_D)
+        at_least_one_activity_inside = output_trips_sim['person'].isin(self.persons_O_or_D)
+        home_inside = output_trips_sim['person'].isin(self.persons_home_inside)
+
+        if self.trip_flags:
+            # The trips table keeps every trip belonging to at least one of the subsets
+            flags = to_flags({
+                O_AND_D: origin_inside & destination_inside,
+                O_OR_D: origin_inside | destination_inside,
+                ALL_ACTIVITIES_INSIDE: all_activities_inside,
+                AT_LEAST_ONE_ACTIVITY_INSIDE: at_least_one_activity_inside,
+                HOME_INSIDE: home_inside,
+            })
+            self.write(FLAGGED_TRIPS, output_trips_sim.assign(**{FLAGS_COLUMN: flags})[flags != 0])
+        else:
+            self.write("trips_all_activities_inside_sim.csv", output_trips_sim[all_activities_inside])
+            self.write("trips_at_least_one_activity_inside_sim.csv", output_trips_sim[at_least_one_activity_inside])
+            if self.home_inside_filter:
+                self.write("trips_population_home_inside_sim.csv", output_trips_sim[home_inside])
+
+
 if __name__ == '__main__':
     setup_logging(get_log_filename())
 
@@ -23,121 +188,86 @@ if __name__ == '__main__':
 
     logging.info(f"sample_for_debugging = {sample_for_debugging}, nrows = {nrows}")
 
-    # Read the XML data with a matsim library
+    config = load_config()
+    # trips_chunk_size > 0 reads output_trips and output_persons in chunks of that many rows, so the memory
+    # depends on the chunk size and not on the simulation size. 0 (default) reads them in one go.
+    trips_chunk_size = config.getint('config', 'trips_chunk_size', fallback=0)
+    # trip_flags writes one trips table and one persons table with the subsets as bit flags (functions/trip_flags.py)
+    trip_flags = use_trip_flags()
+    # home_inside_filter also selects the population with the home inside the area and their trips
+    home_inside_filter = config.getboolean('config', 'home_inside_filter', fallback=False)
+    # analysis_areas filters several areas in one read of the outputs, each in its own subfolder
+    analysis_areas = config.get('config', 'analysis_areas', fallback='')
+    logging.info(f"trips_chunk_size = {trips_chunk_size}, trip_flags = {trip_flags}, "
+                 f"home_inside_filter = {home_inside_filter}, analysis_areas = {analysis_areas}")
+
+    trips_path = os.path.join(output_folder_path, "output_trips.csv.gz")
+    persons_path = os.path.join(output_folder_path, "output_persons.csv.gz")
+
+    # Load geographic data from the shapefiles
+    areas = load_areas(os.path.join(analysis_zone_path, "ShapeFiles"), shapeFileName, analysis_areas)
+    area_polygons = [polygon for _, polygon in areas]
+    logging.info(f"Shapefiles loaded successfully and {len(areas)} area polygons created successfully")
+
+    area_outputs = [
+        AreaOutputs(name, pre_processed_data_path if name is None else os.path.join(pre_processed_data_path, name),
+                    trips_chunk_size, trip_flags, home_inside_filter)
+        for name, _ in areas
+    ]
+
+    # With a single chunk the trips are kept in memory for the second pass instead of being read again
+    trips_in_memory = None
+    if not trips_chunk_size:
+        try:
+            trips_in_memory = next(read_trips_chunks(trips_path, trips_chunk_size, nrows))
+            logging.info("Output Trips data loaded successfully")
+        except Exception as e:
+            logging.error("Error loading network data: " + str(e))
+            sys.exit()
+
+    def trips_chunks():
+        return iter([trips_in_memory]) if trips_in_memory is not None else read_trips_chunks(trips_path, trips_chunk_size, nrows)
+
+    # First pass: filter each chunk against the polygons and append the surviving trips
     try:
-        output_trips_sim = pd.read_csv(os.path.join(output_folder_path, "output_trips.csv.gz"), sep=';', low_memory=False, encoding='utf-8', dtype=str, compression='gzip', nrows=nrows)
-        logging.info("Output Trips data loaded successfully")
+        for output_trips_sim in trips_chunks():
+            # Origin and destination inside each polygon, one lookup for all the areas
+            origin_inside, destination_inside = trips_inside_area_masks(area_polygons, output_trips_sim)
+            for i, area in enumerate(area_outputs):
+                area.add_trips(output_trips_sim, origin_inside[i], destination_inside[i])
     except Exception as e:
         logging.error("Error loading network data: " + str(e))
         sys.exit()
 
-    # Load geographic data from a shapefile
-    shapefile_path = os.path.join(analysis_zone_path, "ShapeFiles", shapeFileName)
-    gdf = gpd.read_file(shapefile_path, engine="pyogrio")
-
-    area_polygon = gdf.iloc[0]['geometry']
-    logging.info("Shapefile loaded successfully and area_polygon created successfully")
-
-    output_trips_sim['start_x'] = output_trips_sim['start_x'].astype(float)
-    output_trips_sim['start_y'] = output_trips_sim['start_y'].astype(float)
-    output_trips_sim['end_x'] = output_trips_sim['end_x'].astype(float)
-    output_trips_sim['end_y'] = output_trips_sim['end_y'].astype(float)
-
-    # Create Point geometries for origin and destination
-    output_trips_sim['origin_point'] = gpd.points_from_xy(output_trips_sim['start_x'], output_trips_sim['start_y'])
-    output_trips_sim['destination_point'] = gpd.points_from_xy(output_trips_sim['end_x'], output_trips_sim['end_y'])
-
-    logging.info("Origin and destination points created successfully")
-
-    output_trips_sim = output_trips_sim.query("longest_distance_mode not in ['outside', 'truck']").reset_index(drop=True)
-
-    # Create origin and destination GeoSeries
-    origin_points = gpd.GeoSeries(gpd.points_from_xy(output_trips_sim['start_x'], output_trips_sim['start_y']),
-                                  crs=gdf.crs)
-    destination_points = gpd.GeoSeries(gpd.points_from_xy(output_trips_sim['end_x'], output_trips_sim['end_y']),
-                                       crs=gdf.crs)
-    logging.info("Origin and destination GeoSeries created successfully")
-
-    # Filtered dataframe (O AND D inside)
-    filtered_trips_inside = output_trips_sim[
-        origin_points.within(area_polygon) &
-        destination_points.within(area_polygon)
-        ]
-
+    for area in area_outputs:
+        area.finish_trips()
     logging.info("Trips filtered successfully based on the shapefile polygon successfully")
 
-    # Filtered dataframe (O OR D inside)
-    filtered_trips_inside_outside = output_trips_sim[
-        origin_points.within(area_polygon) |
-        destination_points.within(area_polygon)
-        ]
-
-    logging.info("Trips filtered successfully based on the shapefile polygon successfully")
-
-    rest_of_trips = output_trips_sim.drop(filtered_trips_inside.index)
-
-    # The ids of the people who have trips inside the area
-    ids_inside = set(filtered_trips_inside['person'])
-
-    # The ids of the people who have trips outside the area
-    ids_rest = set(rest_of_trips['person'])
-
-    # The ids of the people who have trips inside the area but not outside
-    unique_ids = ids_inside.difference(ids_rest)
-
-    if not os.path.exists(pre_processed_data_path):
-        os.makedirs(pre_processed_data_path)
-    filtered_trips_inside.to_csv(os.path.join(pre_processed_data_path, "trips_inside_O_and_D_sim.csv"), index=False)
-    filtered_trips_inside_outside.to_csv(os.path.join(pre_processed_data_path, "trips_inside_O_or_D_sim.csv"), index=False)
-    logging.info("Both Filtered trips saved successfully")
-
-    df_persons_sim = pd.read_csv(os.path.join(output_folder_path, "output_persons.csv.gz"), sep=';', low_memory=False,
-                                   encoding='utf-8', dtype=str, compression='gzip', nrows=nrows)
-
+    # Filter the population to include only those with trips inside the area (O and D),
+    # those with trips origin inside or destination inside the area (O or D) and those with the home inside
+    for df_persons_sim in read_output_chunks(persons_path, trips_chunk_size, nrows,
+                                             dtype=defaultdict(lambda: str, PERSONS_DTYPES)):
+        # HOME SHP FILTER: home coordinates tested against the polygons as arrays
+        home_inside = points_inside_areas(area_polygons, df_persons_sim['home_x'].to_numpy(),
+                                          df_persons_sim['home_y'].to_numpy()) if home_inside_filter else None
+        for i, area in enumerate(area_outputs):
+            area.add_persons(df_persons_sim, None if home_inside is None else home_inside[i])
+
+    for area in area_outputs:
+        area.close()
     logging.info("Output plans data loaded successfully")
-
-    # Filter the population to include only those with trips inside the area
-    population_with_trips_O_and_D = df_persons_sim[df_persons_sim['person'].isin(unique_ids)]
-    logging.info("Population with trips inside the area filtered successfully")
-
-    population_with_trips_O_and_D.to_csv(os.path.join(pre_processed_data_path, "population_all_activities_inside_sim.csv"), index=False)
-
-    # Filter the population to include only those with trips origin inside or destination inside the area
-    population_with_trips_O_or_D = df_persons_sim[
-        df_persons_sim['person'].isin(filtered_trips_inside_outside['person'])]
     logging.info("Population with trips inside the area filtered successfully")
 
-    population_with_trips_O_or_D.to_csv(os.path.join(pre_processed_data_path, "population_at_least_one_activity_inside_sim.csv"), index=False)
+    # Second pass: all the trips of the selected people
+    for output_trips_sim in trips_chunks():
+        origin_inside = destination_inside = None
+        if trip_flags:
+            origin_inside, destination_inside = trips_inside_area_masks(area_polygons, output_trips_sim)
+        for i, area in enumerate(area_outputs):
+            area.add_person_trips(output_trips_sim, None if origin_inside is None else origin_inside[i],
+                                  None if destination_inside is None else destination_inside[i])
 
-    trips_all_activities_inside = output_trips_sim[output_trips_sim['person'].isin(population_with_trips_O_and_D['person'])]
-
-    trips_all_activities_inside.to_csv(os.path.join(pre_processed_data_path, "trips_all_activities_inside_sim.csv"), index=False)
-
-    trips_at_least_one_activity_inside = output_trips_sim[ output_trips_sim['person'].isin(population_with_trips_O_or_D['person'])]
-
-    trips_at_least_one_activity_inside.to_csv( os.path.join(pre_processed_data_path, "trips_at_least_one_activity_inside_sim.csv"), index=False)
+    for area in area_outputs:
+        area.close()
 
     logging.info("Trips with at least one activity inside the area filtered successfully")
-
-    # # HOME SHP FILTER - TO ADD WHEN NEEDED, BECAUSE NOW CONSUMES A LOT OF TIME
-    # df_persons_sim['home_x'] = df_persons_sim['home_x'].astype(float)
-    # df_persons_sim['home_y'] = df_persons_sim['home_y'].astype(float)
-
-    # # Create origin and destination GeoSeries
-    # home_points = gpd.GeoSeries(gpd.points_from_xy(df_persons_sim['home_x'], df_persons_sim['home_y']),
-    #                               crs=gdf.crs)
-    # mask_home_inside = home_points.within(area_polygon)
-    # population_home_inside = df_persons_sim[mask_home_inside]
-    # population_home_inside.to_csv(os.path.join(pre_processed_data_path, "population_home_inside_sim.csv"), index=False)
-    # logging.info("Population with home inside the area filtered successfully")
-
-    # # TRIPS FOR MODAL SPLIT HOMES INIDE - AS ABOVE
-    # trips_population_home_inside = output_trips_sim[output_trips_sim['person'].isin(population_home_inside['person'])]
-    # trips_population_home_inside.to_csv(os.path.join(pre_processed_data_path, "trips_population_home_inside_sim.csv"), index=False)
-    # logging.info("Trips with home inside the area filtered successfully")
-
-
-
-
-
-
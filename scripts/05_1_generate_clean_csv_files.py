@@ -1,36 +1,53 @@
 # Import necessary libraries
 from functions.commonFunctions import *
+from functions.activity_chains import activity_chains, chain_frequencies
+from functions.intermediate_store import read_table, write_table
+from functions.household_members import load_households, households_of_persons
+from functions.microcensus_loader import load_microcensus
+from functions.time_bins import binned_times, integer_seconds, parse_times, to_timedelta
+from functions.trip_flags import (use_trip_flags, select_flagged, FLAGS_COLUMN, FLAGGED_TRIPS, FLAGGED_PERSONS,
+                                  ALL_ACTIVITIES_INSIDE, AT_LEAST_ONE_ACTIVITY_INSIDE)
+import numpy as np
 import pandas as pd
 import warnings
-import matsim
 warnings.filterwarnings('ignore')
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 
 
+# Home activities and persons are matched on their coordinates rounded to the millimetre
+COORDINATE_QUANTUM = 1e-3
+
+
 # Functions
 def process_time_data(df):
     """
-    Function to convert 'dep_time' and 'trav_time' from string to timedelta,
-    then to seconds, and calculate 'arrival_time'.
+    Function to convert 'dep_time' and 'trav_time' from string to seconds (and timedelta),
+    and calculate 'arrival_time'.
     """
-    # Convert 'dep_time' from string to timedelta
-    df['dep_time'] = pd.to_timedelta(df['dep_time'])
-
-    # Convert 'dep_time' from timedelta to seconds
-    df['departure_time'] = df['dep_time'].dt.total_seconds().astype(int)
-
-    # Convert 'trav_time' from string to timedelta
-    df['trav_time'] = pd.to_timedelta(df['trav_time'])
-
-    # Convert 'trav_time' from timedelta to seconds
-    df['trav_time_seconds'] = df['trav_time'].dt.total_seconds().astype(int)
+    # Parse the "HH:MM:SS" strings to seconds, the hours can be 24 and more
+    departure_seconds = parse_times(df['dep_time'])
+    travel_seconds = parse_times(df['trav_time'])
+    missing = np.isnan(departure_seconds) | np.isnan(travel_seconds)
+    if missing.any():
+        logging.warning(f"{int(missing.sum())} trips with a missing or invalid dep_time/trav_time, "
+                        f"their departure_time/arrival_time are left empty")
+
+    # The timedelta columns are kept for the output tables
+    df['dep_time'] = to_timedelta(departure_seconds)
+    df['departure_time'] = integer_seconds(departure_seconds)
+    df['trav_time'] = to_timedelta(travel_seconds)
+    df['trav_time_seconds'] = integer_seconds(travel_seconds)
 
     # Calculate 'arrival_time_seconds' by adding 'trav_time_seconds' to 'dep_time_seconds'
     df['arrival_time'] = df['departure_time'] + df['trav_time_seconds']
 
     return df
 
+def quantize_coordinates(values):
+    """Integer key of the coordinates rounded to COORDINATE_QUANTUM, robust to the float formatting of the csv files."""
+    return (pd.to_numeric(values, errors='coerce') / COORDINATE_QUANTUM).round().astype('Int64')
+
 def map_person_id_to_activities(df_activities, df_persons, activity_type='Home'):
     """
     Map household IDs from df_persons to df_activities based on home coordinates and
@@ -49,13 +66,19 @@ def map_person_id_to_activities(df_activities, df_persons, activity_type='Home')
 
     # Filter df_activities for rows where type is the specified activity type
     home_activities = df_activities[df_activities['type'] == activity_type]
+    home_activities = home_activities.assign(key_x=quantize_coordinates(home_activities['x']),
+                                             key_y=quantize_coordinates(home_activities['y']))
+
+    # Persons without home coordinates cannot be matched
+    persons = df_persons[['person_id', 'home_x', 'home_y']].dropna(subset=['home_x', 'home_y'])
+    persons = persons.assign(key_x=quantize_coordinates(persons['home_x']),
+                             key_y=quantize_coordinates(persons['home_y']))
 
-    # Merge the household IDs from df_persons to home_activities based on coordinate match
+    # Merge the household IDs from df_persons to home_activities based on the quantized coordinates
     merged_home_activities = pd.merge(
         home_activities,
-        df_persons[['person_id', 'home_x', 'home_y']],
-        left_on=['x', 'y'],
-        right_on=['home_x', 'home_y'],
+        persons[['person_id', 'key_x', 'key_y']],
+        on=['key_x', 'key_y'],
         how='left'
     )
 
@@ -68,18 +91,23 @@ def map_person_id_to_activities(df_activities, df_persons, activity_type='Home')
     # Map the hh_id as person_id to all activities in df_activities
     df_activities['person_id'] = df_activities['plan_id'].map(plan_id_to_person_id)
 
-    # Propagate the person_id to other activities in the same plan
-    df_activities['person_id'] = df_activities.groupby('plan_id')['person_id'].transform(lambda x: x.ffill().bfill())
+    # Propagate the person_id to other activities in the same plan (first valid id of the plan)
+    df_activities['person_id'] = df_activities.groupby('plan_id')['person_id'].transform('first')
 
     return df_activities
 
+def single_home_persons(df_activity):
+    """Ids of the persons having one activity only, of type 'Home' (counted per person, without a lambda per group)."""
+    counts = df_activity['type'].eq('Home').groupby(df_activity['person_id'], observed=True).agg(['size', 'sum'])
+    return counts.index[(counts['size'] == 1) & (counts['sum'] == 1)]
+
 def process_activity_and_legs_data(df_activity, df_legs, values_to_remove, modes_to_remove):
 # This function cleans and filters synthetic activity and leg data by removing
 #  unwanted activity types and transport modes, consolidating walk modes, and excluding incomplete or invalid travel plans.
 #  It ensures that persons left with only a single 'Home' activity (after cleaning) are removed unless that was their original state.
 
     # Identify persons with only one 'Home' activity initially
-    initial_single_home = df_activity.groupby('person_id').filter(lambda x: len(x) == 1 and x['type'].eq('Home').all())
+    initial_single_home = single_home_persons(df_activity)
 
     # Filter the activity DataFrame
     df_activity_filtered = df_activity[~df_activity['type'].isin(values_to_remove)]
@@ -100,54 +128,35 @@ def process_activity_and_legs_data(df_activity, df_legs, values_to_remove, modes
     df_legs_filtered = df_legs[~df_legs['main_mode'].isin(modes_to_remove)]
 
     # Identify persons who now only have one 'Home' activity
-    final_single_home = df_activity_filtered.groupby('person_id').filter(
-        lambda x: len(x) == 1 and x['type'].eq('Home').all())
+    final_single_home = single_home_persons(df_activity_filtered)
 
     # Exclude persons who initially had only one 'Home' activity
-    final_single_home = final_single_home[~final_single_home['person_id'].isin(initial_single_home['person_id'])]
+    final_single_home = final_single_home.difference(initial_single_home)
 
     # Remove these persons from the filtered data
-    df_activity_filtered = df_activity_filtered[~df_activity_filtered['person_id'].isin(final_single_home['person_id'])]
+    df_activity_filtered = df_activity_filtered[~df_activity_filtered['person_id'].isin(final_single_home)]
 
     return df_activity_filtered, df_legs_filtered
 
 def create_trips_dataframe(df_activity):
-    # List to hold new trip entries
-    new_trips = []
-
-    # Iterate over the activity DataFrame
-    for i in range(len(df_activity) - 1):
-        # Get current and next row
-        current_row = df_activity.iloc[i]
-        next_row = df_activity.iloc[i + 1]
-
-        # Check if the IDs are consecutive
-        if current_row['id'] + 1 == next_row['id']:
-            # Create a new trip entry
-            new_trips.append({
-                'trip_id': current_row['id'],
-                'departure_time': current_row['end_time'],
-                'arrival_time': next_row['start_time'],
-                'start_coor_x': current_row['x'],
-                'start_coor_y': current_row['y'],
-                'ziel_coor_x': next_row['x'],
-                'ziel_coor_y': next_row['y'],
-
-            })
-
-    # Create a DataFrame from the list of new trips
-    df_trips = pd.DataFrame(new_trips)
+    # A trip goes from each activity to the next row, when the activity ids are consecutive
+    activity_id = df_activity['id'].to_numpy()
+    consecutive = activity_id[:-1] + 1 == activity_id[1:]
+    current_rows = df_activity.iloc[:-1][consecutive]
+    next_rows = df_activity.iloc[1:][consecutive]
+
+    df_trips = pd.DataFrame({
+        'trip_id': current_rows['id'].to_numpy(),
+        'departure_time': current_rows['end_time'].to_numpy(),
+        'arrival_time': next_rows['start_time'].to_numpy(),
+        'start_coor_x': current_rows['x'].to_numpy(),
+        'start_coor_y': current_rows['y'].to_numpy(),
+        'ziel_coor_x': next_rows['x'].to_numpy(),
+        'ziel_coor_y': next_rows['y'].to_numpy(),
+    })
 
     return df_trips
 
-def safe_convert_time(time_str):
-    try:
-        # Convert to datetime, then to time, and floor to 30-minute bins
-        return pd.to_datetime(time_str, format='%H:%M:%S', errors='raise').floor('30T').time()
-    except ValueError:
-        # Handle invalid time data (e.g., return None or a default time)
-        return None
-
 # Group all numbers count car larger equal 3 to 3+
 def group_cars(value):
     # Convert to integer if the value is a string
@@ -163,19 +172,24 @@ def group_cars(value):
     else:
         return str(value_int)
 
-# Function to create activity chains
-def create_activity_chain_mic(group):
-    chain = '-'.join(
-        ['H'] + [purpose[0] for purpose in group['purpose'].tolist()])  # Add 'H' at the start of each chain
-    return pd.Series({'activity_chain': chain})
+def clean_sim_trips(df_trips, extra_columns=()):
+    """
+    Keep the columns of the clean sim trips, renamed, without the trips with no mode and the truck trips.
+    trip_number is kept when the trips have it, to align the trips of two simulations in 05_2.
+    """
+    trip_number = ["trip_number"] if "trip_number" in df_trips.columns else []
+    df_clean = df_trips[[
+        "person", *trip_number, "start_link", "end_link", "dep_time", "trav_time", "euclidean_distance",
+        "longest_distance_mode", "start_x", "start_y",
+        "end_x", "end_y", *extra_columns]]
 
-# Function to create uppercase activity chains
-def create_activity_chain_syn(group):
-    chain = '-'.join([purpose[0].upper() for purpose in group['type'].tolist()])
-    return pd.Series({'activity_chain': chain})
+    df_clean = df_clean.rename(
+        columns={'trav_time': 'travel_time', 'euclidean_distance': 'distance', 'longest_distance_mode': 'mode'})
+    df_clean = df_clean.dropna(subset=['mode'])
+    return df_clean[~df_clean['mode'].isin(['truck'])]
 
 def extract_just_personID_and_household_weight_from_hausalteCSV(path):
-    df_mz_households = pd.read_csv(os.path.join(path, "microzensus", "haushalte.csv"), sep=",", encoding="latin1")
+    df_mz_households = load_microcensus(os.path.join(path, "microzensus"), "haushalte.csv", ["HHNR", "WM"])
     df_mz_households["person_id"] = df_mz_households["HHNR"]
     df_mz_households["household_weight"] = df_mz_households["WM"]
 
@@ -203,18 +217,27 @@ if __name__ == '__main__':
 
     # Read the csv files
     try:
-        df_activity_sim = pd.read_csv(os.path.join(pre_processed_data_path, "df_activity_sim.csv"), low_memory=False)
-        df_population_all_activities_inside_sim = pd.read_csv(os.path.join(pre_processed_data_path, "population_all_activities_inside_sim.csv"), low_memory=False)
-        df_population_at_least_one_activity_inside_sim = pd.read_csv(os.path.join(pre_processed_data_path, "population_at_least_one_activity_inside_sim.csv"), low_memory=False)
-        df_trips_all_activities_inside_sim = pd.read_csv(os.path.join(pre_processed_data_path, "trips_all_activities_inside_sim.csv"), low_memory=False)
-        df_trips_at_least_one_activity_inside_sim = pd.read_csv(os.path.join(pre_processed_data_path, "trips_at_least_one_activity_inside_sim.csv"), low_memory=False)
+        df_activity_sim = read_table(os.path.join(pre_processed_data_path, "df_activity_sim.csv"))
+        if use_trip_flags():
+            # One trips and one persons table, the subsets are selected by their flag
+            df_trips_flagged_sim = process_time_data(read_table(os.path.join(pre_processed_data_path, FLAGGED_TRIPS)))
+            df_persons_flagged_sim = read_table(os.path.join(pre_processed_data_path, FLAGGED_PERSONS))
+            df_population_all_activities_inside_sim = select_flagged(df_persons_flagged_sim, ALL_ACTIVITIES_INSIDE)
+            df_population_at_least_one_activity_inside_sim = select_flagged(df_persons_flagged_sim, AT_LEAST_ONE_ACTIVITY_INSIDE)
+            df_trips_all_activities_inside_sim = select_flagged(df_trips_flagged_sim, ALL_ACTIVITIES_INSIDE)
+            df_trips_at_least_one_activity_inside_sim = select_flagged(df_trips_flagged_sim, AT_LEAST_ONE_ACTIVITY_INSIDE)
+        else:
+            df_population_all_activities_inside_sim = read_table(os.path.join(pre_processed_data_path, "population_all_activities_inside_sim.csv"))
+            df_population_at_least_one_activity_inside_sim = read_table(os.path.join(pre_processed_data_path, "population_at_least_one_activity_inside_sim.csv"))
+            df_trips_all_activities_inside_sim = process_time_data(read_table(os.path.join(pre_processed_data_path, "trips_all_activities_inside_sim.csv")))
+            df_trips_at_least_one_activity_inside_sim = process_time_data(read_table(os.path.join(pre_processed_data_path, "trips_at_least_one_activity_inside_sim.csv")))
 
         if read_SynPop:
-            df_households_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_households_synt.csv"), low_memory=False)
-            df_activity_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_activity_synt.csv"), low_memory=False)
-            df_legs_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_legs_synt.csv"), low_memory=False)
-            df_persons_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_persons_synt.csv"), low_memory=False)
-            df_routes_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_routes_synt.csv"), low_memory=False)
+            df_households_synt = read_table(os.path.join(pre_processed_data_path, "df_households_synt.csv"))
+            df_activity_synt = read_table(os.path.join(pre_processed_data_path, "df_activity_synt.csv"))
+            df_legs_synt = read_table(os.path.join(pre_processed_data_path, "df_legs_synt.csv"))
+            df_persons_synt = read_table(os.path.join(pre_processed_data_path, "df_persons_synt.csv"))
+            df_routes_synt = read_table(os.path.join(pre_processed_data_path, "df_routes_synt.csv"))
 
         if read_microcensus:
             df_population_all_activities_inside_mic = pd.read_csv(os.path.join(microcensus_path, "population_all_activities_inside_Mic.csv"))
@@ -227,9 +250,7 @@ if __name__ == '__main__':
         logging.error("Error reading csv files: " + str(e))
         sys.exit()
 
-    # Run process_time_data for both df_legs_synt and df_legs_sim
-    df_trips_all_activities_inside_sim = process_time_data(df_trips_all_activities_inside_sim)
-    df_trips_at_least_one_activity_inside_sim = process_time_data(df_trips_at_least_one_activity_inside_sim)
+    # process_time_data is already run on the sim trips when they are read
     if read_SynPop:
         df_legs_synt = process_time_data(df_legs_synt)
 
@@ -256,23 +277,17 @@ if __name__ == '__main__':
     df_population_all_activities_inside_sim.rename(columns={'person': 'person_id'}, inplace=True)
 
     try:
-        households_sim = matsim.household_reader(os.path.join(output_folder_path, "output_households.xml.gz"))
-        df_households_sim = households_sim.households
+        # Households and their exploded members, cached next to the pre-processed tables
+        df_households_sim, df_household_members_sim = load_households(
+            os.path.join(output_folder_path, "output_households.xml.gz"), os.path.join(pre_processed_data_path, "cache"))
         logging.info("output_households.xml.gz loaded successfully")
     except Exception as e:
         logging.error("Error loading output_households.xml.gz: " + str(e))
         sys.exit()
-    # Set of relevant person_ids
-    valid_person_ids = set(df_population_at_least_one_activity_inside_sim['person_id'].unique())
-    # Filter households where at least one person is in valid_person_ids
-    # Only apply eval if the element is a string
-    df_households_sim['members'] = df_households_sim['members'].apply(
-        lambda x: eval(x) if isinstance(x, str) else x
-    )  # Convert string repr to list
-    df_households_sim_filtered = df_households_sim[
-        df_households_sim['members'].apply(lambda members: any(pid in valid_person_ids for pid in members))]
-    df_households_sim_filtered.to_csv(
-        os.path.join(data_path_clean, "households_all_activities_inside_sim.csv"), index=False)
+    # Filter households where at least one person is in the relevant person_ids
+    df_households_sim_filtered = households_of_persons(
+        df_households_sim, df_household_members_sim, df_population_at_least_one_activity_inside_sim['person_id'].unique())
+    write_table(df_households_sim_filtered, os.path.join(data_path_clean, "households_all_activities_inside_sim.csv"))
 
     df_activity_population_all_activities_inside_sim = map_person_id_to_activities(df_activity_sim, df_population_all_activities_inside_sim)
     if read_SynPop:
@@ -294,31 +309,27 @@ if __name__ == '__main__':
             df_activity_synt, df_legs_synt, values_to_remove, modes_to_remove)
         df_activity_synt = df_activity_synt_filtered
         df_activity_synt['type'] = df_activity_synt['type'].str.replace('_', ' ').str.title()
-        df_activity_chains_syn = df_activity_synt.groupby(['plan_id']).apply(create_activity_chain_syn).reset_index()
+        df_activity_chains_syn = activity_chains(df_activity_synt, 'plan_id', 'type', upper=True)
 
         df_legs_synt = df_legs_synt_filtered
         df_legs_synt['mode'] = df_legs_synt['mode'].str.replace('_', ' ').str.title()
 
         df_trips_synt = create_trips_dataframe(df_activity_synt)
         df_trips_synt = df_trips_synt.dropna()
-        df_trips_synt['departure_time'] = df_trips_synt['departure_time'].apply(safe_convert_time)
-        df_trips_synt['arrival_time'] = df_trips_synt['arrival_time'].apply(safe_convert_time)
+        df_trips_synt['departure_time'] = binned_times(df_trips_synt['departure_time'])
+        df_trips_synt['arrival_time'] = binned_times(df_trips_synt['arrival_time'])
 
 
     if read_microcensus:
-        # Convert seconds to datetime and resample times to 15-minute bins
+        # Bin the times (seconds) into 30-minute bins
         df_trips_at_least_one_activity_inside_mic = df_trips_at_least_one_activity_inside_mic.dropna()
-        df_trips_at_least_one_activity_inside_mic['departure_time'] = df_trips_at_least_one_activity_inside_mic['departure_time'].apply(safe_convert_time)
-        df_trips_at_least_one_activity_inside_mic['arrival_time'] = df_trips_at_least_one_activity_inside_mic['arrival_time'].apply(safe_convert_time)
-        df_trips_at_least_one_activity_inside_mic['departure_time'] = pd.to_datetime(df_trips_at_least_one_activity_inside_mic['departure_time'], unit='s').dt.floor('30T').dt.time
-        df_trips_at_least_one_activity_inside_mic['arrival_time'] = pd.to_datetime(df_trips_at_least_one_activity_inside_mic['arrival_time'], unit='s').dt.floor('30T').dt.time
+        df_trips_at_least_one_activity_inside_mic['departure_time'] = binned_times(df_trips_at_least_one_activity_inside_mic['departure_time'])
+        df_trips_at_least_one_activity_inside_mic['arrival_time'] = binned_times(df_trips_at_least_one_activity_inside_mic['arrival_time'])
         df_trips_at_least_one_activity_inside_mic['mode'] = df_trips_at_least_one_activity_inside_mic['mode'].str.replace('_', ' ').str.title()
 
         df_trips_all_activities_inside_mic = df_trips_all_activities_inside_mic.dropna()
-        df_trips_all_activities_inside_mic['departure_time'] = df_trips_all_activities_inside_mic['departure_time'].apply(safe_convert_time)
-        df_trips_all_activities_inside_mic['arrival_time'] = df_trips_all_activities_inside_mic['arrival_time'].apply(safe_convert_time)
-        df_trips_all_activities_inside_mic['departure_time'] = pd.to_datetime(df_trips_all_activities_inside_mic['departure_time'], unit='s').dt.floor('30T').dt.time
-        df_trips_all_activities_inside_mic['arrival_time'] = pd.to_datetime(df_trips_all_activities_inside_mic['arrival_time'], unit='s').dt.floor('30T').dt.time
+        df_trips_all_activities_inside_mic['departure_time'] = binned_times(df_trips_all_activities_inside_mic['departure_time'])
+        df_trips_all_activities_inside_mic['arrival_time'] = binned_times(df_trips_all_activities_inside_mic['arrival_time'])
         df_trips_all_activities_inside_mic['mode'] = df_trips_all_activities_inside_mic['mode'].str.replace('_', ' ').str.title()
 
         # Apply the grouping function to the 'number_of_cars' column
@@ -328,69 +339,49 @@ if __name__ == '__main__':
         df_population_all_activities_inside_mic['number_of_cars'] = df_population_all_activities_inside_mic['number_of_cars'].apply(group_cars)
         df_population_all_activities_inside_mic['sex'] = df_population_all_activities_inside_mic['sex'].replace({0: 'male', 1: 'female'})
 
-        df_activity_chains_at_least_one_activity_mic = df_trips_at_least_one_activity_inside_mic.groupby(['person_id']).apply(create_activity_chain_mic).reset_index()
-        df_activity_chains_all_activities_inside_mic = df_trips_all_activities_inside_mic.groupby(['person_id']).apply(create_activity_chain_mic).reset_index()
+        df_activity_chains_at_least_one_activity_mic = activity_chains(df_trips_at_least_one_activity_inside_mic, 'person_id', 'purpose', prefix='H')
+        df_activity_chains_all_activities_inside_mic = activity_chains(df_trips_all_activities_inside_mic, 'person_id', 'purpose', prefix='H')
 
-    df_activity_chains_sim = df_activity_sim.groupby(['plan_id']).apply(create_activity_chain_syn).reset_index()
+    df_activity_chains_sim = activity_chains(df_activity_sim, 'plan_id', 'type', upper=True)
 
     if read_microcensus:
         # Ensure the directory exists
         if not os.path.exists(data_path_clean):
             os.makedirs(data_path_clean)
         # Write the CSV files
-        df_trips_at_least_one_activity_inside_mic.to_csv(
-            os.path.join(data_path_clean, "trips_at_least_one_activity_inside_mic.csv"), index=False)
-        df_trips_all_activities_inside_mic.to_csv(os.path.join(data_path_clean, "trips_all_activities_inside_mic.csv"),
-                                                  index=False)
+        write_table(df_trips_at_least_one_activity_inside_mic, os.path.join(data_path_clean, "trips_at_least_one_activity_inside_mic.csv"))
+        write_table(df_trips_all_activities_inside_mic, os.path.join(data_path_clean, "trips_all_activities_inside_mic.csv"))
+
+        write_table(df_activity_chains_at_least_one_activity_mic, os.path.join(data_path_clean, "activity_chains_at_least_one_activity_inside_mic.csv"))
+        write_table(df_activity_chains_all_activities_inside_mic, os.path.join(data_path_clean, "activity_chains_all_activities_inside_mic.csv"))
+
+        write_table(df_population_all_activities_inside_mic, os.path.join(data_path_clean, "population_all_activities_inside_mic.csv"))
+        write_table(df_population_at_least_one_activity_inside_mic, os.path.join(data_path_clean, "population_at_least_one_activity_inside_mic.csv"))
 
-        df_activity_chains_at_least_one_activity_mic.to_csv(
-            os.path.join(data_path_clean, "activity_chains_at_least_one_activity_inside_mic.csv"), index=False)
-        df_activity_chains_all_activities_inside_mic.to_csv(
-            os.path.join(data_path_clean, "activity_chains_all_activities_inside_mic.csv"), index=False)
+        if read_SynPop:
+            write_table(df_trips_synt, os.path.join(data_path_clean, "trips_synt.csv"))
+            write_table(df_activity_chains_syn, os.path.join(data_path_clean, "activity_chains_syn.csv"))
+            write_table(df_persons_synt, os.path.join(data_path_clean, "population_clean_synth.csv"))
+            write_table(df_legs_synt, os.path.join(data_path_clean, "legs_clean_synt.csv"))
+
+        write_table(df_activity_chains_sim, os.path.join(data_path_clean, "activity_chains_sim.csv"))
+        write_table(df_population_all_activities_inside_sim, os.path.join(data_path_clean, "population_all_activities_inside_sim.csv"))
+        write_table(df_population_at_least_one_activity_inside_sim, os.path.join(data_path_clean, "population_at_least_one_activity_inside_sim.csv"))
 
-        df_population_all_activities_inside_mic.to_csv(
-            os.path.join(data_path_clean, "population_all_activities_inside_mic.csv"), index=False)
-        df_population_at_least_one_activity_inside_mic.to_csv(
-            os.path.join(data_path_clean, "population_at_least_one_activity_inside_mic.csv"), index=False)
+    if use_trip_flags():
+        write_table(clean_sim_trips(df_trips_flagged_sim, extra_columns=[FLAGS_COLUMN]), os.path.join(data_path_clean, FLAGGED_TRIPS))
+    else:
+        write_table(clean_sim_trips(df_trips_at_least_one_activity_inside_sim), os.path.join(data_path_clean, "trips_at_least_one_activity_inside_sim.csv"))
 
+        write_table(clean_sim_trips(df_trips_all_activities_inside_sim), os.path.join(data_path_clean, "trips_all_activities_inside_sim.csv"))
+
+    if load_config().getboolean('config', 'chain_frequencies', fallback=False):
+        # One chain frequency table per dataset, compared with a join on activity_chain
+        chain_tables = {'sim': df_activity_chains_sim}
         if read_SynPop:
-            df_trips_synt.to_csv(os.path.join(data_path_clean, "trips_synt.csv"), index=False)
-            df_activity_chains_syn.to_csv(os.path.join(data_path_clean, "activity_chains_syn.csv"), index=False)
-            df_persons_synt.to_csv(os.path.join(data_path_clean, "population_clean_synth.csv"), index=False)
-            df_legs_synt.to_csv(os.path.join(data_path_clean, "legs_clean_synt.csv"), index=False)
-
-        df_activity_chains_sim.to_csv(os.path.join(data_path_clean, "activity_chains_sim.csv"), index=False)
-        df_population_all_activities_inside_sim.to_csv(
-            os.path.join(data_path_clean, "population_all_activities_inside_sim.csv"), index=False)
-        df_population_at_least_one_activity_inside_sim.to_csv(
-            os.path.join(data_path_clean, "population_at_least_one_activity_inside_sim.csv"), index=False)
-
-    filtered_trips_at_least_one_activitiy_inside_sim = df_trips_all_activities_inside_sim[[
-        "person", "start_link", "end_link", "dep_time", "trav_time", "euclidean_distance", "longest_distance_mode",
-        "start_x", "start_y",
-        "end_x", "end_y"]]
-
-    filtered_trips_at_least_one_activitiy_inside_sim.rename(
-        columns={'trav_time': 'travel_time', 'euclidean_distance': 'distance', 'longest_distance_mode': 'mode'},
-        inplace=True)
-    filtered_trips_at_least_one_activitiy_inside_sim.dropna(subset=['mode'], inplace=True)
-    filtered_trips_all_activities_inside_sim = filtered_trips_at_least_one_activitiy_inside_sim[
-        ~filtered_trips_at_least_one_activitiy_inside_sim['mode'].isin(['truck'])]
-
-    filtered_trips_at_least_one_activitiy_inside_sim = df_trips_at_least_one_activity_inside_sim[[
-        "person", "start_link", "end_link", "dep_time", "trav_time", "euclidean_distance", "longest_distance_mode",
-        "start_x", "start_y",
-        "end_x", "end_y"]]
-
-    filtered_trips_at_least_one_activitiy_inside_sim.rename(
-        columns={'trav_time': 'travel_time', 'euclidean_distance': 'distance', 'longest_distance_mode': 'mode'},
-        inplace=True)
-    filtered_trips_at_least_one_activitiy_inside_sim.dropna(subset=['mode'], inplace=True)
-    filtered_trips_at_least_one_activitiy_inside_sim = filtered_trips_at_least_one_activitiy_inside_sim[
-        ~filtered_trips_at_least_one_activitiy_inside_sim['mode'].isin(['truck'])]
-
-    filtered_trips_at_least_one_activitiy_inside_sim.to_csv(
-        os.path.join(data_path_clean, "trips_at_least_one_activity_inside_sim.csv"), index=False)
-
-    filtered_trips_all_activities_inside_sim.to_csv(
-        os.path.join(data_path_clean, "trips_all_activities_inside_sim.csv"), index=False)
+            chain_tables['syn'] = df_activity_chains_syn
+        if read_microcensus:
+            chain_tables['at_least_one_activity_inside_mic'] = df_activity_chains_at_least_one_activity_mic
+            chain_tables['all_activities_inside_mic'] = df_activity_chains_all_activities_inside_mic
+        for dataset, df_chains in chain_tables.items():
+            write_table(chain_frequencies(df_chains), os.path.join(data_path_clean, f"activity_chain_frequencies_{dataset}.csv"))
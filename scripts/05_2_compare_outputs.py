@@ -1,11 +1,27 @@
 from pandas import DataFrame
 import time
 from datetime import datetime
+import numpy as np
 import pandas as pd
 from functions.commonFunctions import *
+from functions.person_sequences import PersonLayout
+from functions.time_bins import parse_times
+from functions.intermediate_store import read_table
+from functions.trip_flags import read_subset, read_subset_chunks
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 start_time = time.time()
 
+# Rows read at a time when the trips files are partitioned into buckets
+PARTITION_CHUNK_SIZE = 1_000_000
+
+# Alignments of the trip-level diff, and the column names of the trip values in the trips files
+TRIP_ALIGNMENTS = ('departure', 'trip_number')
+DEPARTURE_COLUMNS = ('dep_time', 'departure_time')
+TRAVEL_TIME_COLUMNS = ('travel_time', 'trav_time')
+DISTANCE_COLUMNS = ('distance', 'traveled_distance', 'euclidean_distance')
+
 
 def _fmt_mode(m):
     """Format a mode string like 'car_ride' -> 'Car Ride'; handle None/NaN."""
@@ -28,6 +44,139 @@ def _fmt_mode_series(s: pd.Series) -> pd.Series:
 # ---------------------------
 # Summary generation
 # ---------------------------
+def person_mode_pairs(keys: np.ndarray, n_modes: int):
+    """Distinct (person, mode) pairs of the integer keys person * n_modes + mode, sorted, with their counts."""
+    pairs, counts = np.unique(keys, return_counts=True)
+    pair_persons, pair_modes = np.divmod(pairs, n_modes)
+    return pair_persons, pair_modes, counts
+
+
+def transition_matrix(df1_filtered: pd.DataFrame, df2_filtered: pd.DataFrame):
+    """
+    Mode transition counts between the filtered datasets, from the sparse (person, mode) counts.
+
+    The matrix has one row and one column per mode, plus a last 'None' row and column:
+    - persons in both datasets: every pair of their modes, n1 * n2 records (mode 1 -> mode 2)
+    - persons only in dataset 1: their records go to (mode 1 -> None)
+    - persons with more records in dataset 2: the new persons' records, and for the others the difference
+      distributed over their modes in proportion of their counts (rounded), go to (None -> mode 2)
+    Only the (person, mode) pairs found are counted (no persons x modes array), the per-person arrays
+    have one value per person.
+    Returns the matrix, the mask of the transitions found (also those rounded to 0 records) and the modes.
+    """
+    persons = np.union1d(df1_filtered['person'].unique(), df2_filtered['person'].unique())
+    modes = pd.Index(df1_filtered['mode'].dropna().unique()).union(pd.Index(df2_filtered['mode'].dropna().unique()))
+    n_modes = len(modes)
+    n_persons = len(persons)
+
+    def pairs_and_totals(df):
+        person_codes = np.searchsorted(persons, df['person'].to_numpy()).astype(np.int64)
+        valid = df['mode'].notna().to_numpy()
+        keys = person_codes[valid] * n_modes + modes.get_indexer(df['mode'][valid])
+        return person_mode_pairs(keys, n_modes), np.bincount(person_codes, minlength=n_persons)
+
+    (persons_1, modes_1, counts_1), totals_1 = pairs_and_totals(df1_filtered)
+    (persons_2, modes_2, counts_2), totals_2 = pairs_and_totals(df2_filtered)
+    valid_totals_2 = np.bincount(persons_2, weights=counts_2, minlength=n_persons)
+    in_1 = np.zeros(n_persons, dtype=bool)
+    in_2 = np.zeros(n_persons, dtype=bool)
+    in_1[persons_1] = True
+    in_2[persons_2] = True
+
+    def mode_sums(pair_modes, weights):
+        return np.bincount(pair_modes, weights=weights, minlength=n_modes).round().astype(np.int64)
+
+    transitions = np.zeros((n_modes + 1, n_modes + 1), dtype=np.int64)
+    present = np.zeros((n_modes + 1, n_modes + 1), dtype=bool)
+
+    # Common persons: every pair of a (person, mode 1) pair with a (person, mode 2) pair of the same person
+    starts = np.searchsorted(persons_2, persons_1, side='left')
+    lengths = np.searchsorted(persons_2, persons_1, side='right') - starts
+    index_1 = np.repeat(np.arange(len(persons_1)), lengths)
+    index_2 = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    common = np.bincount(modes_1[index_1] * n_modes + modes_2[index_2],
+                         weights=counts_1[index_1] * counts_2[index_2], minlength=n_modes * n_modes)
+    transitions[:n_modes, :n_modes] = common.round().astype(np.int64).reshape(n_modes, n_modes)
+    present[:n_modes, :n_modes] = transitions[:n_modes, :n_modes] > 0
+
+    # Only left: persons only in Dataset 1
+    left_only = ~in_2[persons_1]
+    transitions[:n_modes, n_modes] = mode_sums(modes_1[left_only], counts_1[left_only])
+    present[:n_modes, n_modes] = transitions[:n_modes, n_modes] > 0
+
+    # Persons with NET POSITIVE records in Dataset 2
+    diff = totals_2 - totals_1
+    with_extra = (diff > 0) & in_2
+    logging.info(f"Found {int(with_extra.sum())} persons with extra records in Dataset 2")
+    logging.info(f"Total extra records to attribute: {int(diff[diff > 0].sum())}")
+
+    # Completely new persons: all their records
+    completely_new = (with_extra & ~in_1)[persons_2]
+    new_records = mode_sums(modes_2[completely_new], counts_2[completely_new])
+
+    # Persons with extra records: the difference distributed proportionally to their modes
+    has_extra = (with_extra & in_1)[persons_2]
+    extra_persons = persons_2[has_extra]
+    proportions = counts_2[has_extra] / valid_totals_2[extra_persons]
+    extra_records = mode_sums(modes_2[has_extra], np.round(diff[extra_persons] * proportions))
+
+    transitions[n_modes, :n_modes] = new_records + extra_records
+    present[n_modes, :n_modes] = (new_records > 0) | (np.bincount(modes_2[has_extra], minlength=n_modes) > 0)
+    return transitions, present, modes
+
+
+def summary_parts(
+        df1_post_freight: pd.DataFrame,
+        df2_post_freight: pd.DataFrame,
+        merged_counts: pd.DataFrame,
+        df1_filtered: pd.DataFrame,
+        df2_filtered: pd.DataFrame
+) -> dict:
+    """
+    Counts of the summary report: outside records, same modes (to_drop per mode) and transitions (records per
+    display name). They are sums over the persons, so the parts of disjoint sets of persons can be combined
+    with combine_summary_parts.
+    """
+    # ----- Outside statistics (on post-freight, pre-outside)
+    logging.info("Calculating outside mode statistics (post-freight data)")
+    parts = {
+        'n1': len(df1_post_freight),
+        'n2': len(df2_post_freight),
+        'outside_count_1': int((df1_post_freight['mode'] == 'outside').sum()),
+        'outside_count_2': int((df2_post_freight['mode'] == 'outside').sum()),
+    }
+
+    # ----- Same modes section (what was dropped as equal/common)
+    parts['same_modes'] = merged_counts.groupby('mode', observed=True)['to_drop'].sum().reset_index()
+
+    # ----- Transitions (different modes between datasets)
+    logging.info("Computing transitions summary")
+
+    # CORRECTED LOGIC: Track ALL differences at record level, as a (mode 1 -> mode 2) matrix
+    transitions, present, modes = transition_matrix(df1_filtered, df2_filtered)
+
+    # One row per transition, the same display names being summed (e.g. 'car_ride' and 'Car Ride')
+    labels = list(_fmt_mode_series(pd.Series(modes, dtype=object))) + ['None']
+    rows, columns = np.nonzero(present)
+    all_transitions = pd.DataFrame({
+        'display': [f"{labels[i]}_{labels[j]}" for i, j in zip(rows, columns)],
+        'cnt': transitions[rows, columns].astype('int64'),
+    })
+    parts['transitions'] = all_transitions.groupby('display', as_index=False)['cnt'].sum()
+    return parts
+
+
+def combine_summary_parts(parts_list: list) -> dict:
+    """Sum the summary parts of disjoint sets of persons (e.g. the buckets of a partitioned comparison)."""
+    combined = {key: sum(parts[key] for parts in parts_list)
+                for key in ('n1', 'n2', 'outside_count_1', 'outside_count_2')}
+    combined['same_modes'] = (pd.concat([parts['same_modes'] for parts in parts_list], ignore_index=True)
+                              .groupby('mode', observed=True)['to_drop'].sum().reset_index())
+    combined['transitions'] = (pd.concat([parts['transitions'] for parts in parts_list], ignore_index=True)
+                               .groupby('display', as_index=False)['cnt'].sum())
+    return combined
+
+
 def generate_summary_file(
         df1_post_freight: pd.DataFrame,
         df2_post_freight: pd.DataFrame,
@@ -42,13 +191,30 @@ def generate_summary_file(
         all_df_2_records: int = 0,
         df_freight_removed_1: int = 0,
         df_freight_removed_2: int = 0
-) -> None:
+) -> pd.DataFrame:
     """
     Generate a summary report text file with statistics about outside mode,
     same-mode drops, and transitions between datasets.
 
     CORRECTED VERSION: Now properly tracks all extra records as None_ transitions
+    Returns the transition table written to the CSV file.
     """
+    parts = summary_parts(df1_post_freight, df2_post_freight, merged_counts, df1_filtered, df2_filtered)
+    return write_summary_file(parts, output_path, first_file_name, second_file_name, all_df_1_records,
+                              all_df_2_records, df_freight_removed_1, df_freight_removed_2)
+
+
+def write_summary_file(
+        parts: dict,
+        output_path: str = None,
+        first_file_name: str = "",
+        second_file_name: str = "",
+        all_df_1_records: int = 0,
+        all_df_2_records: int = 0,
+        df_freight_removed_1: int = 0,
+        df_freight_removed_2: int = 0
+) -> pd.DataFrame:
+    """Write the summary report (text and CSV) of the summary parts. Returns the transition table of the CSV."""
     logging.info("Starting summary file generation")
     t0 = time.time()
 
@@ -64,11 +230,10 @@ def generate_summary_file(
     transition_df = pd.DataFrame(columns=transition_columns)
 
     # ----- Outside statistics (on post-freight, pre-outside)
-    logging.info("Calculating outside mode statistics (post-freight data)")
-    outside_count_1 = (df1_post_freight['mode'] == 'outside').sum()
-    outside_count_2 = (df2_post_freight['mode'] == 'outside').sum()
-    n1 = len(df1_post_freight)
-    n2 = len(df2_post_freight)
+    outside_count_1 = parts['outside_count_1']
+    outside_count_2 = parts['outside_count_2']
+    n1 = parts['n1']
+    n2 = parts['n2']
     outside_1_pct = (outside_count_1 / n1 * 100) if n1 else 0.0
     outside_2_pct = (outside_count_2 / n2 * 100) if n2 else 0.0
 
@@ -87,28 +252,14 @@ def generate_summary_file(
     transition_df = pd.concat([transition_df, pd.DataFrame(new_data_list)], ignore_index=True)
 
     # ----- Same modes section (what was dropped as equal/common)
-    mode_summary = (
-        merged_counts.groupby('mode', observed=True)['to_drop']
-        .sum()
-        .reset_index()
-        .sort_values('to_drop', ascending=False)
-    )
-
-    # # Add total records statistics
-    # total_records_excluding_outside_freight = len(df1_filtered) + len(df2_filtered) + int(mode_summary['to_drop'].sum())
-    # total_overall = total_records_excluding_outside_freight + int(outside_count_1) + int(outside_count_2)
-    #
-    # lines.append(f"Total overall number of records: {total_overall}\n\n")
-    # lines.append(f"Total number of records excluding outside and freight: {total_records_excluding_outside_freight}\n")
-    #
-    # lines.append("-" * 85 + "\n")
+    mode_summary = parts['same_modes'].sort_values('to_drop', ascending=False)
 
     lines.append(f"Total Outside records in Data 1: ( {int(outside_count_1)} records - {outside_1_pct:.2f}% )\n")
     lines.append(f"Total Outside records in Data 2: ( {int(outside_count_2)} records - {outside_2_pct:.2f}% )\n")
     lines.append("-" * 85 + "\n")
     lines.append("Same Modes\n")
 
-    total_clean_records = max(len(df1_post_freight), len(df2_post_freight))
+    total_clean_records = max(n1, n2)
     new_data_list = []
     for _, r in mode_summary.iterrows():
         mode_fmt = _fmt_mode(r['mode'])
@@ -126,156 +277,12 @@ def generate_summary_file(
     lines.append("\n")
     lines.append("Total Number of Same Modes is "f"{int(mode_summary['to_drop'].sum())} records\n")
 
-
-
     transition_df = pd.concat([transition_df, pd.DataFrame(new_data_list)], ignore_index=True)
     lines.append("-" * 85 + "\n")
 
     # ----- Transitions (different modes between datasets)
     lines.append("Mode Transitions (Different Modes Between Datasets)\n")
-    logging.info("Computing transitions summary")
-
-    # CORRECTED LOGIC: Track ALL differences at record level
-    # Get total record counts per person in filtered datasets
-    person_counts_1 = df1_filtered.groupby('person').size().reset_index(name='total_records_1')
-    person_counts_2 = df2_filtered.groupby('person').size().reset_index(name='total_records_2')
-
-    # Merge to see who has more/fewer records
-    person_totals = pd.merge(
-        person_counts_1, person_counts_2,
-        on='person', how='outer'
-    ).fillna(0)
-
-    person_totals['diff'] = person_totals['total_records_2'] - person_totals['total_records_1']
-
-    # Per-person mode counts in the filtered sets
-    c1 = df1_filtered.groupby(['person', 'mode'], observed=True).size().reset_index(name='n1')
-    c2 = df2_filtered.groupby(['person', 'mode'], observed=True).size().reset_index(name='n2')
-
-    # Persons present in both / only left / only right
-    p1 = pd.Index(c1['person'].unique())
-    p2 = pd.Index(c2['person'].unique())
-    common_persons = p1.intersection(p2)
-    only_left_persons = p1.difference(p2)
-    only_right_persons = p2.difference(p1)
-
-    # Common persons: calculate transitions
-    common = (
-        c1[c1['person'].isin(common_persons)]
-        .merge(c2[c2['person'].isin(common_persons)], on='person', how='inner', suffixes=('_first', '_second'))
-    )
-    if not common.empty:
-        left = _fmt_mode_series(common['mode_first'])
-        right = _fmt_mode_series(common['mode_second'])
-        common['display'] = left.str.cat(right, sep='_')
-        common['cnt'] = (common['n1'] * common['n2']).astype('int64')
-        common_agg = common.groupby('display', as_index=False)['cnt'].sum()
-        common_per_person = common.groupby(['person', 'display'], as_index=False)['cnt'].sum()
-    else:
-        common_agg = pd.DataFrame(columns=['display', 'cnt'])
-        common_per_person = pd.DataFrame(columns=['person', 'display', 'cnt'])
-
-    # CORRECTED: For persons with extra records in Dataset 2, attribute to None_ transitions
-    # Only left: persons only in Dataset 1
-    left_only = c1[c1['person'].isin(only_left_persons)].copy()
-    if not left_only.empty:
-        left_only['display'] = _fmt_mode_series(left_only['mode']).str.cat(
-            pd.Series(['None'] * len(left_only), index=left_only.index, dtype='string'),
-            sep='_'
-        )
-        left_only['cnt'] = left_only['n1'].astype('int64')
-        left_only_agg = left_only.groupby('display', as_index=False)['cnt'].sum()
-        left_only_per_person = left_only.groupby(['person', 'display'], as_index=False)['cnt'].sum()
-    else:
-        left_only_agg = pd.DataFrame(columns=['display', 'cnt'])
-        left_only_per_person = pd.DataFrame(columns=['person', 'display', 'cnt'])
-
-    # CORRECTED: Only right + persons with NET POSITIVE records in Dataset 2
-    # This captures ALL extra records, not just persons completely absent from Dataset 1
-    persons_with_extra = person_totals[person_totals['diff'] > 0]['person'].values
-    logging.info(f"Found {len(persons_with_extra)} persons with extra records in Dataset 2")
-    logging.info(f"Total extra records to attribute: {int(person_totals[person_totals['diff'] > 0]['diff'].sum())}")
-
-    right_with_extra = c2[c2['person'].isin(persons_with_extra)].copy()
-
-    if not right_with_extra.empty:
-        # For each person, we need to know how many extra records they have
-        right_with_extra = right_with_extra.merge(
-            person_totals[['person', 'diff']],
-            on='person',
-            how='left'
-        )
-
-        # Calculate what portion of each mode should be attributed to "None_Mode"
-        # Group by person to get total mode counts
-        person_mode_totals = right_with_extra.groupby('person').agg({
-            'n2': 'sum',
-            'diff': 'first'
-        }).reset_index()
-
-        # For simplicity, distribute extra records proportionally across modes
-        # Or we can just take all records for persons only in Dataset 2
-        right_only_persons_set = set(only_right_persons)
-
-        # Separate completely new persons vs persons with extra records
-        completely_new = right_with_extra[right_with_extra['person'].isin(right_only_persons_set)].copy()
-        has_extra_but_exists = right_with_extra[~right_with_extra['person'].isin(right_only_persons_set)].copy()
-
-        # For completely new persons, count all their records
-        if not completely_new.empty:
-            completely_new['display'] = pd.Series(['None'] * len(completely_new),
-                                                  index=completely_new.index,
-                                                  dtype='string').str.cat(
-                _fmt_mode_series(completely_new['mode']),
-                sep='_'
-            )
-            completely_new['cnt'] = completely_new['n2'].astype('int64')
-            new_persons_agg = completely_new.groupby('display', as_index=False)['cnt'].sum()
-        else:
-            new_persons_agg = pd.DataFrame(columns=['display', 'cnt'])
-
-        # For persons with extra records, attribute the DIFFERENCE proportionally
-        if not has_extra_but_exists.empty:
-            # Calculate proportion of each mode for each person
-            person_mode_props = has_extra_but_exists.groupby('person')['n2'].sum().reset_index(name='total_modes')
-            has_extra_but_exists = has_extra_but_exists.merge(person_mode_props, on='person')
-            has_extra_but_exists['mode_proportion'] = has_extra_but_exists['n2'] / has_extra_but_exists['total_modes']
-
-            # Distribute the diff proportionally to modes
-            has_extra_but_exists['extra_for_mode'] = (has_extra_but_exists['diff'] *
-                                                      has_extra_but_exists['mode_proportion']).round().astype('int64')
-
-            has_extra_but_exists['display'] = pd.Series(['None'] * len(has_extra_but_exists),
-                                                        index=has_extra_but_exists.index,
-                                                        dtype='string').str.cat(
-                _fmt_mode_series(has_extra_but_exists['mode']),
-                sep='_'
-            )
-            extra_records_agg = has_extra_but_exists.groupby('display', as_index=False)['extra_for_mode'].sum()
-            extra_records_agg.columns = ['display', 'cnt']
-        else:
-            extra_records_agg = pd.DataFrame(columns=['display', 'cnt'])
-
-        # Combine both types of "None_" records
-        right_only_agg = pd.concat([new_persons_agg, extra_records_agg], ignore_index=True)
-        if not right_only_agg.empty:
-            right_only_agg = right_only_agg.groupby('display', as_index=False)['cnt'].sum()
-
-        # For detailed per-person tracking
-        right_only_per_person = pd.concat([
-            completely_new.groupby(['person', 'display'], as_index=False)['cnt'].sum(),
-            has_extra_but_exists.groupby(['person', 'display'], as_index=False)['extra_for_mode'].sum().rename(
-                columns={'extra_for_mode': 'cnt'})
-        ], ignore_index=True)
-
-    else:
-        right_only_agg = pd.DataFrame(columns=['display', 'cnt'])
-        right_only_per_person = pd.DataFrame(columns=['person', 'display', 'cnt'])
-
-    # Concatenate all aggregated transitions
-    all_transitions = pd.concat([common_agg, left_only_agg, right_only_agg], ignore_index=True)
-    all_transitions = all_transitions.groupby('display', as_index=False)['cnt'].sum()
-    all_transitions = all_transitions.sort_values('cnt', ascending=False)
+    all_transitions = parts['transitions'].sort_values('cnt', ascending=False)
 
     # Write summary
     new_data_list = []
@@ -337,90 +344,118 @@ def generate_summary_file(
     transition_df.to_csv(csv_file, sep=';', index=False, encoding='utf-8-sig')
     logging.info(f"Summary CSV saved to '{csv_file}'")
 
+    return transition_df
 
-def analyze_transport_modes(
-        file1: str,
-        file2: str,
-        detailed_expanded: bool = False,
-        nrows: int = None,
-        output_path: str = None,
-        first_file_name: str = "",
-        second_file_name: str = ""
-):
+
+class PreparedTrips:
     """
-    Analyze transport mode changes between two simulation outputs.
-    CORRECTED VERSION: Properly tracks all extra records
+    Trips of one simulation, read and cleaned once: the baseline of a multi-scenario comparison is
+    prepared one time and compared with each of the other scenarios.
     """
-    logging.info("=" * 60)
-    logging.info("Starting transport mode analysis")
-    logging.info(f"Input file 1: {file1}")
-    logging.info(f"Input file 2: {file2}")
 
-    # Load data
-    logging.info("Loading CSV files...")
-    t_load = time.time()
-    nrows_arg = None if (nrows is None or nrows == -1) else nrows
-    df1 = pd.read_csv(file1, nrows=nrows_arg)
-    df2 = pd.read_csv(file2, nrows=nrows_arg)
-    all_df_1_records = len(df1)
-    all_df_2_records = len(df2)
-    logging.info(f"Data loaded in {time.time() - t_load:.2f} seconds")
-    logging.info(f"Data 1 initial shape: {df1.shape}")
-    logging.info(f"Data 2 initial shape: {df2.shape}")
-
-    # ----- Filter out freight
-    logging.info("Filtering out freight records...")
-    freight_1 = (df1['mode'] == 'freight').sum()
-    freight_2 = (df2['mode'] == 'freight').sum()
-    df1_post_freight = df1.loc[df1['mode'] != 'freight'].copy()
-    df2_post_freight = df2.loc[df2['mode'] != 'freight'].copy()
-    logging.info(f"Removed {int(freight_1)} freight records from Data 1")
-    logging.info(f"Removed {int(freight_2)} freight records from Data 2")
-    logging.info(f"Data 1 after freight filter: {len(df1_post_freight)} records")
-    logging.info(f"Data 2 after freight filter: {len(df2_post_freight)} records")
-    df1 = df1_post_freight
-    df2 = df2_post_freight
-
-    # ----- Convert person IDs
-    logging.info("Converting person IDs to int32...")
-    df1['person'] = pd.to_numeric(df1['person'], errors='coerce').astype('Int64')
-    df2['person'] = pd.to_numeric(df2['person'], errors='coerce').astype('Int64')
-    n1_before, n2_before = len(df1), len(df2)
-    df1 = df1.dropna(subset=['person']).copy()
-    df2 = df2.dropna(subset=['person']).copy()
-    df_freight_removed_1 = n1_before - len(df1)
-    df_freight_removed_2 = n2_before - len(df2)
-    logging.info(f"Dropped {n1_before - len(df1)} non-numeric person IDs in Data 1")
-    logging.info(f"Dropped {n2_before - len(df2)} non-numeric person IDs in Data 2")
-    df1['person'] = df1['person'].astype('int32')
-    df2['person'] = df2['person'].astype('int32')
-
-    # ----- Drop outside mode
-    logging.info("Filtering out 'outside' mode records...")
-    outside_1 = (df1['mode'] == 'outside').sum()
-    outside_2 = (df2['mode'] == 'outside').sum()
-    df1_clean = df1.loc[df1['mode'] != 'outside'].copy()
-    df2_clean = df2.loc[df2['mode'] != 'outside'].copy()
-    logging.info(f"Removed {int(outside_1)} outside records from Data 1")
-    logging.info(f"Removed {int(outside_2)} outside records from Data 2")
-    logging.info(f"Data 1 clean: {len(df1_clean)} records")
-    logging.info(f"Data 2 clean: {len(df2_clean)} records")
+    def __init__(self, file_path: str, nrows: int = None, label: str = "Data", fmt: str = None):
+        self.file_path = file_path
+        self.label = label
+
+        # Load data
+        logging.info(f"Loading {label} from {file_path}...")
+        t_load = time.time()
+        nrows_arg = None if (nrows is None or nrows == -1) else nrows
+        # The clean subsets are selected from the flagged trips table when 05_1 was run with trip_flags
+        df = read_table(file_path, nrows=nrows_arg, fmt=fmt) if fmt else read_subset(file_path, nrows=nrows_arg)
+        self.all_records = len(df)
+        logging.info(f"{label} loaded in {time.time() - t_load:.2f} seconds, initial shape: {df.shape}")
+
+        # ----- Filter out freight
+        freight = (df['mode'] == 'freight').sum()
+        self.post_freight = df.loc[df['mode'] != 'freight'].copy()
+        logging.info(f"Removed {int(freight)} freight records from {label}")
+        logging.info(f"{label} after freight filter: {len(self.post_freight)} records")
+        df = self.post_freight
+
+        # ----- Convert person IDs
+        df['person'] = pd.to_numeric(df['person'], errors='coerce').astype('Int64')
+        n_before = len(df)
+        df = df.dropna(subset=['person']).copy()
+        self.freight_removed = n_before - len(df)
+        logging.info(f"Dropped {self.freight_removed} non-numeric person IDs in {label}")
+        df['person'] = df['person'].astype('int32')
+
+        # ----- Drop outside mode
+        outside = (df['mode'] == 'outside').sum()
+        self.clean = df.loc[df['mode'] != 'outside'].copy()
+        logging.info(f"Removed {int(outside)} outside records from {label}")
+        logging.info(f"{label} clean: {len(self.clean)} records")
+
+        # Rows sorted once by person code (functions/person_sequences.py), reused for the ranks and the primary modes
+        self.layout = PersonLayout(self.clean['person'])
+
+        # Rank entries within each (person, mode) group
+        self.clean['rank'] = self.layout.cumcount(self.clean['mode'])
+
+        # Integer mode codes (-1 for a missing mode), mapped to the dictionary shared with the other dataset
+        self.mode_codes, self.modes = pd.factorize(self.clean['mode'], sort=True)
+
+        # Primary mode per person (before dropping equals)
+        self.primary_modes = get_primary_mode(self.clean[['person', 'mode']], self.layout)
+
+
+def get_primary_mode(df: pd.DataFrame, layout: PersonLayout) -> pd.DataFrame:
+    # Most frequent mode of each person (ties: first mode in sorted order)
+    primary = pd.DataFrame({'person': layout.persons, 'primary_mode': layout.argmax_count(df['mode'])})
+    return primary.dropna(subset=['primary_mode'])
+
+
+def encode_person_modes(trips_1: PreparedTrips, trips_2: PreparedTrips):
+    """
+    Integer (person, mode) key of each row of both datasets, person * n_modes + mode in the person and mode
+    dictionaries shared by the two datasets (both sorted, -1 for the rows with a missing mode).
+    """
+    persons = np.union1d(trips_1.layout.persons, trips_2.layout.persons)
+    modes = trips_1.modes.union(trips_2.modes)
+    n_modes = max(len(modes), 1)
+
+    keys = []
+    for trips in (trips_1, trips_2):
+        person_codes = np.searchsorted(persons, trips.layout.persons)[trips.layout.codes].astype(np.int64)
+        mode_codes = modes.get_indexer(trips.modes)[trips.mode_codes]
+        keys.append(np.where(trips.mode_codes >= 0, person_codes * n_modes + mode_codes, -1))
+    return keys[0], keys[1], persons, modes
+
+
+def compare_trip_counts(trips_1: PreparedTrips, trips_2: PreparedTrips):
+    """
+    Compare two prepared trip tables: same modes, transitions and primary modes.
+    Returns the primary mode comparison and the summary parts (see summary_parts).
+    """
+    df1_clean = trips_1.clean
+    df2_clean = trips_2.clean
 
     # Log the difference
     diff_records = len(df2_clean) - len(df1_clean)
     logging.info(f"**RECORD DIFFERENCE: Dataset 2 has {diff_records} more records than Dataset 1**")
 
-    # ----- Count occurrences per (person, mode)
+    # ----- Count occurrences per (person, mode), only the pairs found (sorted integer (person, mode) keys)
     logging.info("Counting mode occurrences per person...")
     t_count = time.time()
-    df1_counts = df1_clean.groupby(['person', 'mode'], observed=True).size().reset_index(name='count_1')
-    df2_counts = df2_clean.groupby(['person', 'mode'], observed=True).size().reset_index(name='count_2')
-    logging.info(f"Data 1: {len(df1_counts)} unique person-mode combinations")
-    logging.info(f"Data 2: {len(df2_counts)} unique person-mode combinations")
-
-    # Find common (person, mode) and compute to_drop = min(count_1, count_2)
-    merged_counts = pd.merge(df1_counts, df2_counts, on=['person', 'mode'], how='inner')
-    merged_counts['to_drop'] = merged_counts[['count_1', 'count_2']].min(axis=1)
+    keys_1, keys_2, persons, modes = encode_person_modes(trips_1, trips_2)
+    n_modes = max(len(modes), 1)
+    pair_keys_1, counts_1 = np.unique(keys_1[keys_1 >= 0], return_counts=True)
+    pair_keys_2, counts_2 = np.unique(keys_2[keys_2 >= 0], return_counts=True)
+    logging.info(f"Data 1: {len(pair_keys_1)} unique person-mode combinations")
+    logging.info(f"Data 2: {len(pair_keys_2)} unique person-mode combinations")
+
+    # Common (person, mode) and to_drop = min(count_1, count_2)
+    common_keys, common_1, common_2 = np.intersect1d(pair_keys_1, pair_keys_2, assume_unique=True, return_indices=True)
+    to_drop = np.minimum(counts_1[common_1], counts_2[common_2])
+    common_persons, common_modes = np.divmod(common_keys, n_modes)
+    merged_counts = pd.DataFrame({
+        'person': persons[common_persons],
+        'mode': np.asarray(modes, dtype=object)[common_modes],
+        'count_1': counts_1[common_1],
+        'count_2': counts_2[common_2],
+        'to_drop': to_drop,
+    })
     total_to_drop = int(merged_counts['to_drop'].sum())
     logging.info(f"Found {len(merged_counts)} common person-mode combinations")
     logging.info(f"Total records to drop (common modes): {total_to_drop}")
@@ -430,68 +465,405 @@ def analyze_transport_modes(
     logging.info("Filtering datasets to keep only different modes (vectorized)...")
     t_filter = time.time()
 
-    # Rank entries within each (person, mode) group
-    df1_clean = df1_clean.copy()
-    df2_clean = df2_clean.copy()
-    df1_clean['rank'] = df1_clean.groupby(['person', 'mode'], observed=True).cumcount()
-    df2_clean['rank'] = df2_clean.groupby(['person', 'mode'], observed=True).cumcount()
-
-    # Map to_drop to each row via merge (missing -> 0)
-    drop_map = merged_counts[['person', 'mode', 'to_drop']]
-    df1_f = df1_clean.merge(drop_map, on=['person', 'mode'], how='left')
-    df2_f = df2_clean.merge(drop_map, on=['person', 'mode'], how='left')
-    df1_f['to_drop'] = df1_f['to_drop'].fillna(0).astype('int64')
-    df2_f['to_drop'] = df2_f['to_drop'].fillna(0).astype('int64')
+    # Keep rows where rank >= to_drop of their (person, mode), the ranks are computed when the trips are prepared
+    def keep_different(df_clean: pd.DataFrame, keys: np.ndarray) -> pd.DataFrame:
+        # to_drop of the row's (person, mode) found in the sorted common keys, 0 if it is not common
+        row_to_drop = np.zeros(len(keys), dtype=np.int64)
+        if len(common_keys):
+            positions = np.minimum(np.searchsorted(common_keys, keys), len(common_keys) - 1)
+            found = common_keys[positions] == keys
+            row_to_drop[found] = to_drop[positions[found]]
+        keep = df_clean['rank'].to_numpy() >= row_to_drop
+        return df_clean.loc[keep, ['person', 'mode']].reset_index(drop=True)
 
-    # Keep rows where rank >= to_drop
-    df1_filtered = df1_f.loc[df1_f['rank'] >= df1_f['to_drop'], ['person', 'mode']].reset_index(drop=True)
-    df2_filtered = df2_f.loc[df2_f['rank'] >= df2_f['to_drop'], ['person', 'mode']].reset_index(drop=True)
+    df1_filtered = keep_different(df1_clean, keys_1)
+    df2_filtered = keep_different(df2_clean, keys_2)
 
     logging.info(f"Final filtered datasets - Data 1: {len(df1_filtered)} records, Data 2: {len(df2_filtered)} records")
     logging.info(
         f"**FILTERED DIFFERENCE: {len(df2_filtered) - len(df1_filtered)} extra records in Dataset 2 filtered**")
     logging.info(f"Filtering completed in {time.time() - t_filter:.2f} seconds")
 
-    # ----- Primary mode per person (before dropping equals)
-    logging.info("Calculating primary modes for each person...")
-    t_primary = time.time()
-
-    def get_primary_mode(df: pd.DataFrame) -> pd.DataFrame:
-        mode_counts = df.groupby(['person', 'mode'], observed=True).size().reset_index(name='count')
-        idx = mode_counts.groupby('person')['count'].idxmax()
-        primary = mode_counts.loc[idx, ['person', 'mode']].rename(columns={'mode': 'primary_mode'})
-        return primary
-
-    primary_modes_1 = get_primary_mode(df1_clean[['person', 'mode']])
-    primary_modes_2 = get_primary_mode(df2_clean[['person', 'mode']])
-
+    # ----- Primary mode per person (computed when the trips are prepared)
     comparison = pd.merge(
-        primary_modes_1, primary_modes_2, on='person',
+        trips_1.primary_modes, trips_2.primary_modes, on='person',
         suffixes=('_first', '_second'), how='inner'
     )
     comparison['mode_changed'] = comparison['primary_mode_first'] != comparison['primary_mode_second']
     changed_count = int(comparison['mode_changed'].sum())
     unchanged_count = len(comparison) - changed_count
     logging.info(f"Primary mode comparison: {changed_count} persons changed mode, {unchanged_count} kept same mode")
-    logging.info(f"Primary mode analysis completed in {time.time() - t_primary:.2f} seconds")
+
+    parts = summary_parts(trips_1.post_freight, trips_2.post_freight, merged_counts, df1_filtered, df2_filtered)
+    return comparison, parts
+
+
+def compare_prepared_trips(
+        trips_1: PreparedTrips,
+        trips_2: PreparedTrips,
+        detailed_expanded: bool = False,
+        output_path: str = None,
+        first_file_name: str = "",
+        second_file_name: str = "",
+        trip_alignment: str = None
+):
+    """
+    Compare two prepared trip tables and write their summary (and the trip diff if trip_alignment is
+    one of TRIP_ALIGNMENTS). Returns the primary mode comparison and the transition table of the summary.
+    """
+    comparison, parts = compare_trip_counts(trips_1, trips_2)
 
     # ----- Generate summary report
-    generate_summary_file(
-        df1_post_freight=df1_post_freight,
-        df2_post_freight=df2_post_freight,
-        merged_counts=merged_counts,
-        df1_filtered=df1_filtered,
-        df2_filtered=df2_filtered,
-        detailed_expanded=detailed_expanded,
+    transition_df = write_summary_file(
+        parts,
         output_path=output_path,
         first_file_name=first_file_name,
         second_file_name=second_file_name,
-        all_df_1_records=all_df_1_records,
-        all_df_2_records=all_df_2_records,
-        df_freight_removed_1=df_freight_removed_1,
-        df_freight_removed_2=df_freight_removed_2
+        all_df_1_records=trips_1.all_records,
+        all_df_2_records=trips_2.all_records,
+        df_freight_removed_1=trips_1.freight_removed,
+        df_freight_removed_2=trips_2.freight_removed
     )
 
+    if trip_alignment:
+        write_trip_diff(trips_1, trips_2, trip_alignment, output_path, first_file_name, second_file_name)
+
+    return comparison, transition_df
+
+
+def first_column(df: pd.DataFrame, names: tuple):
+    """First of the names that is a column of df, None if there is none."""
+    return next((name for name in names if name in df.columns), None)
+
+
+def trip_keys(trips: PreparedTrips, person_codes: np.ndarray, align_by: str) -> np.ndarray:
+    """
+    Sequence number of each trip of trips.post_freight within its person: the trip_number column, or
+    the rank of the trip in departure-time order (row order for ties or without a departure column).
+    """
+    df = trips.post_freight
+    if align_by == 'trip_number':
+        return pd.to_numeric(df['trip_number'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    departure = first_column(df, DEPARTURE_COLUMNS)
+    order_by = parse_times(df[departure]) if departure else None
+    return PersonLayout(person_codes, order_by=order_by).cumcount()
+
+
+def trip_columns(trips: PreparedTrips, rows: np.ndarray) -> dict:
+    """Mode, distance, travel time and departure time (seconds) of the given rows of trips.post_freight."""
+    df = trips.post_freight
+    distance = first_column(df, DISTANCE_COLUMNS)
+    travel_time = first_column(df, TRAVEL_TIME_COLUMNS)
+    departure = first_column(df, DEPARTURE_COLUMNS)
+
+    def seconds(column):
+        if column is None:
+            return np.full(len(rows), np.nan)
+        return parse_times(df[column].iloc[rows])
+
+    return {
+        'mode': df['mode'].to_numpy(dtype=object)[rows],
+        'distance': (pd.to_numeric(df[distance], errors='coerce').to_numpy(dtype=float)[rows]
+                     if distance else np.full(len(rows), np.nan)),
+        'travel_time': seconds(travel_time),
+        'departure_time': seconds(departure),
+    }
+
+
+def align_trips(trips_1: PreparedTrips, trips_2: PreparedTrips, align_by: str = 'departure') -> pd.DataFrame:
+    """
+    Trip-level diff of two simulations: the trips (freight and non-numeric persons removed, outside kept)
+    are aligned on an integer (person, trip) key, by trip_number or by departure-time order within the
+    person, with a merge of the two sorted key arrays. One row per trip of either dataset, sorted by
+    (person, trip), with the modes, the distance and time deltas (2 - 1) and the status
+    (both, only_1, only_2).
+    """
+    t0 = time.time()
+    df_1 = trips_1.post_freight
+    df_2 = trips_2.post_freight
+    if align_by == 'trip_number' and not ('trip_number' in df_1.columns and 'trip_number' in df_2.columns):
+        # e.g. clean trips written by 05_1 before trip_number was kept
+        logging.warning("No trip_number column in both trips files, the trips are aligned by departure time")
+        align_by = 'departure'
+    valid_1 = np.flatnonzero(df_1['person'].notna().to_numpy())
+    valid_2 = np.flatnonzero(df_2['person'].notna().to_numpy())
+    persons_1 = df_1['person'].to_numpy()[valid_1].astype(np.int64)
+    persons_2 = df_2['person'].to_numpy()[valid_2].astype(np.int64)
+
+    # Shared person codes, and sequence of each trip within its person
+    person_codes, persons = pd.factorize(np.concatenate([persons_1, persons_2]), sort=True)
+    codes_1, codes_2 = person_codes[:len(valid_1)], person_codes[len(valid_1):]
+    sequence_1 = np.full(len(df_1), -1, dtype=np.int64)
+    sequence_2 = np.full(len(df_2), -1, dtype=np.int64)
+    codes_all_1 = np.full(len(df_1), -1, dtype=np.int64)
+    codes_all_2 = np.full(len(df_2), -1, dtype=np.int64)
+    codes_all_1[valid_1], codes_all_2[valid_2] = codes_1, codes_2
+    sequence_1[valid_1] = trip_keys(trips_1, codes_all_1, align_by)[valid_1]
+    sequence_2[valid_2] = trip_keys(trips_2, codes_all_2, align_by)[valid_2]
+
+    # Integer (person, trip) keys, the trips without a sequence are left out
+    stride = max(sequence_1.max(initial=0), sequence_2.max(initial=0)) + 1
+    keep_1 = valid_1[sequence_1[valid_1] >= 0]
+    keep_2 = valid_2[sequence_2[valid_2] >= 0]
+    keys_1 = codes_all_1[keep_1] * stride + sequence_1[keep_1]
+    keys_2 = codes_all_2[keep_2] * stride + sequence_2[keep_2]
+
+    def sorted_unique(keys, rows, label):
+        # Sorted keys, the repeated (person, trip) keys keep their first row
+        order = np.argsort(keys, kind='stable')
+        keys, rows = keys[order], rows[order]
+        first = np.r_[True, keys[1:] != keys[:-1]]
+        if not first.all():
+            logging.warning(f"{int((~first).sum())} repeated (person, trip) keys ignored in {label}")
+        return keys[first], rows[first]
+
+    keys_1, rows_1 = sorted_unique(keys_1, keep_1, trips_1.label)
+    keys_2, rows_2 = sorted_unique(keys_2, keep_2, trips_2.label)
+
+    # Merge of the sorted keys
+    positions = np.searchsorted(keys_2, keys_1)
+    matched_1 = positions < len(keys_2)
+    matched_1[matched_1] = keys_2[positions[matched_1]] == keys_1[matched_1]
+    matched_2 = np.zeros(len(keys_2), dtype=bool)
+    matched_2[positions[matched_1]] = True
+
+    # Rows: matched trips, then the trips of only one dataset, sorted by key
+    keys = np.concatenate([keys_1, keys_2[~matched_2]])
+    status = np.concatenate([np.where(matched_1, 'both', 'only_1'), np.full((~matched_2).sum(), 'only_2')])
+    row_1 = np.concatenate([rows_1, np.full((~matched_2).sum(), -1)])
+    matched_rows_2 = np.full(len(keys_1), -1, dtype=np.int64)
+    matched_rows_2[matched_1] = rows_2[positions[matched_1]]
+    row_2 = np.concatenate([matched_rows_2, rows_2[~matched_2]])
+    order = np.argsort(keys, kind='stable')
+    keys, status, row_1, row_2 = keys[order], status[order], row_1[order], row_2[order]
+
+    def side(trips, rows):
+        # Columns of one dataset, NaN where the trip is not in it
+        present = rows >= 0
+        values = trip_columns(trips, rows[present])
+        columns = {}
+        for name, column in values.items():
+            full = np.full(len(rows), None if column.dtype == object else np.nan, dtype=column.dtype)
+            full[present] = column
+            columns[name] = full
+        return columns
+
+    values_1 = side(trips_1, row_1)
+    values_2 = side(trips_2, row_2)
+    person_code, trip = np.divmod(keys, stride)
+    result = pd.DataFrame({
+        'person': np.asarray(persons)[person_code],
+        'trip': trip,
+        'status': status,
+        'mode_1': values_1['mode'],
+        'mode_2': values_2['mode'],
+    })
+    result['mode_changed'] = (status == 'both') & (result['mode_1'].fillna('') != result['mode_2'].fillna('')).to_numpy()
+    for name in ('distance', 'travel_time', 'departure_time'):
+        result[f'{name}_1'] = values_1[name]
+        result[f'{name}_2'] = values_2[name]
+        result[f'{name}_delta'] = values_2[name] - values_1[name]
+
+    logging.info(f"Trips aligned by {align_by} in {time.time() - t0:.2f} seconds: "
+                 f"{int(matched_1.sum())} in both, {int((~matched_1).sum())} only in {trips_1.label}, "
+                 f"{int((~matched_2).sum())} only in {trips_2.label}, "
+                 f"{int(result['mode_changed'].sum())} mode changes")
+    return result
+
+
+def write_trip_diff(
+        trips_1: PreparedTrips,
+        trips_2: PreparedTrips,
+        align_by: str,
+        output_path: str = None,
+        first_file_name: str = "",
+        second_file_name: str = ""
+) -> pd.DataFrame:
+    """Write the trips that changed mode or exist in one dataset only to <first>_<second>_trip_diff.csv."""
+    aligned = align_trips(trips_1, trips_2, align_by)
+    changes = aligned[aligned['mode_changed'] | (aligned['status'] != 'both')]
+    diff_file = os.path.join(output_path if output_path and os.path.isdir(output_path) else '.',
+                             f'{first_file_name}_{second_file_name}_trip_diff.csv')
+    changes.to_csv(diff_file, sep=';', index=False, encoding='utf-8-sig')
+    logging.info(f"Trip diff ({len(changes)} trips) saved to '{diff_file}'")
+    return changes
+
+
+def analyze_transport_modes(
+        file1: str,
+        file2: str,
+        detailed_expanded: bool = False,
+        nrows: int = None,
+        output_path: str = None,
+        first_file_name: str = "",
+        second_file_name: str = "",
+        trip_alignment: str = None
+):
+    """
+    Analyze transport mode changes between two simulation outputs.
+    CORRECTED VERSION: Properly tracks all extra records
+    """
+    logging.info("=" * 60)
+    logging.info("Starting transport mode analysis")
+    logging.info(f"Input file 1: {file1}")
+    logging.info(f"Input file 2: {file2}")
+
+    trips_1 = PreparedTrips(file1, nrows, label="Data 1")
+    trips_2 = PreparedTrips(file2, nrows, label="Data 2")
+    comparison, _ = compare_prepared_trips(trips_1, trips_2, detailed_expanded, output_path,
+                                           first_file_name, second_file_name, trip_alignment)
+    return comparison
+
+
+def scenario_name(file_path: str) -> str:
+    """Name of a scenario in the summary file names, from its trips file path."""
+    name = os.path.splitext(os.path.basename(file_path.replace('\\', '/')))[0]
+    if name.endswith('.csv'):
+        name = os.path.splitext(name)[0]
+    if name == 'trips_all_activities_inside_sim':
+        # Generic file name: the folder of the file names the scenario
+        return os.path.basename(os.path.dirname(file_path.replace('\\', '/')))
+    if name.startswith('trips_all_activities_inside_sim_'):
+        name = name.replace('trips_all_activities_inside_sim_', '', 1)
+    return name
+
+
+def compare_scenarios(
+        baseline_file: str,
+        scenario_files: list,
+        nrows: int = None,
+        output_path: str = None,
+        baseline_name: str = None,
+        trip_alignment: str = None
+):
+    """
+    Compare several scenarios with one baseline: the baseline is read and prepared once, each scenario
+    is read, compared and released in turn. One summary is written per (baseline, scenario) pair, and a
+    combined matrix (one row per scenario, one column per mode transition, the number of records) in
+    <baseline>_scenarios_matrix.csv.
+    """
+    baseline_name = baseline_name or scenario_name(baseline_file)
+    logging.info("=" * 60)
+    logging.info(f"Comparing {len(scenario_files)} scenarios with the baseline {baseline_file}")
+    baseline = PreparedTrips(baseline_file, nrows, label=f"Baseline {baseline_name}")
+
+    comparisons = {}
+    matrix_rows = {}
+    for scenario_file in scenario_files:
+        name = scenario_name(scenario_file)
+        logging.info("-" * 60)
+        logging.info(f"Scenario {name}: {scenario_file}")
+        scenario = PreparedTrips(scenario_file, nrows, label=f"Scenario {name}")
+        comparison, transition_df = compare_prepared_trips(baseline, scenario, output_path=output_path,
+                                                           first_file_name=baseline_name, second_file_name=name,
+                                                           trip_alignment=trip_alignment)
+        comparisons[name] = comparison
+        matrix_rows[name] = transition_df.set_index('Mode Transition')['Records']
+        del scenario
+
+    # Combined matrix, the transitions missing in a scenario have 0 records
+    matrix = pd.DataFrame(matrix_rows).T.fillna(0).astype('int64')
+    matrix.index.name = 'Scenario'
+    matrix_file = os.path.join(output_path if output_path and os.path.isdir(output_path) else '.',
+                               f'{baseline_name}_scenarios_matrix.csv')
+    matrix.to_csv(matrix_file, sep=';', encoding='utf-8-sig')
+    logging.info(f"Scenario matrix saved to '{matrix_file}'")
+
+    return comparisons
+
+
+def person_hashes(person: pd.Series) -> np.ndarray:
+    """
+    Hash of each person id, of its numeric value as in PreparedTrips (so '123' and '123.0' are the same
+    person), of the raw string for the non-numeric ids (dropped later, but counted in the summary).
+    """
+    ids = pd.to_numeric(person, errors='coerce')
+    numeric = ids.notna().to_numpy()
+    hashes = np.empty(len(person), dtype=np.uint64)
+    hashes[numeric] = pd.util.hash_array(ids.to_numpy(dtype=float)[numeric].astype(np.int64))
+    hashes[~numeric] = pd.util.hash_array(person.fillna('').astype(str).to_numpy(dtype=object)[~numeric])
+    return hashes
+
+
+def partition_trips(file_path: str, folder: str, prefix: str, n_buckets: int, nrows: int = None,
+                    chunk_size: int = PARTITION_CHUNK_SIZE) -> list:
+    """
+    Split the person and mode columns of a trips file into n_buckets csv files by a hash of the person id
+    (person_hashes), read in chunks of chunk_size rows. All the trips of a person go to the same bucket, in their order.
+    """
+    paths = [os.path.join(folder, f"{prefix}_{bucket}.csv") for bucket in range(n_buckets)]
+    written = np.zeros(n_buckets, dtype=bool)
+    nrows_arg = None if (nrows is None or nrows == -1) else nrows
+    columns = ['person', 'mode']
+    for chunk in read_subset_chunks(file_path, chunk_size, columns=columns, nrows=nrows_arg):
+        chunk = chunk[columns]
+        buckets = person_hashes(chunk['person']) % n_buckets
+        for bucket in np.unique(buckets):
+            chunk[buckets == bucket].to_csv(paths[bucket], mode='a' if written[bucket] else 'w',
+                                            header=not written[bucket], index=False)
+            written[bucket] = True
+    # Buckets without any trip still get the header
+    for bucket in np.flatnonzero(~written):
+        pd.DataFrame(columns=columns).to_csv(paths[bucket], index=False)
+    logging.info(f"{file_path} partitioned into {n_buckets} buckets in {folder}")
+    return paths
+
+
+def compare_bucket(bucket_file_1: str, bucket_file_2: str):
+    """Compare one bucket of both datasets (run in a worker process in the parallel mode)."""
+    trips_1 = PreparedTrips(bucket_file_1, label=f"Data 1 {os.path.basename(bucket_file_1)}", fmt='csv')
+    trips_2 = PreparedTrips(bucket_file_2, label=f"Data 2 {os.path.basename(bucket_file_2)}", fmt='csv')
+    comparison, parts = compare_trip_counts(trips_1, trips_2)
+    records = (trips_1.all_records, trips_2.all_records, trips_1.freight_removed, trips_2.freight_removed)
+    return comparison, parts, records
+
+
+def analyze_transport_modes_partitioned(
+        file1: str,
+        file2: str,
+        n_buckets: int,
+        workers: int = 1,
+        nrows: int = None,
+        output_path: str = None,
+        first_file_name: str = "",
+        second_file_name: str = "",
+        bucket_folder: str = None
+):
+    """
+    Same comparison and summary as analyze_transport_modes, without holding both trip tables in memory:
+    both files are hash-partitioned by person into on-disk buckets (in a temporary folder inside
+    bucket_folder), the buckets are compared one by one (or by workers processes), and the summary
+    parts of the buckets are summed into one summary.
+    """
+    logging.info("=" * 60)
+    logging.info(f"Starting partitioned transport mode analysis ({n_buckets} buckets, {workers} workers)")
+    logging.info(f"Input file 1: {file1}")
+    logging.info(f"Input file 2: {file2}")
+
+    with tempfile.TemporaryDirectory(dir=bucket_folder or None) as folder:
+        buckets_1 = partition_trips(file1, folder, 'data_1', n_buckets, nrows)
+        buckets_2 = partition_trips(file2, folder, 'data_2', n_buckets, nrows)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(compare_bucket, buckets_1, buckets_2))
+        else:
+            results = [compare_bucket(bucket_1, bucket_2) for bucket_1, bucket_2 in zip(buckets_1, buckets_2)]
+
+    comparison = pd.concat([result[0] for result in results], ignore_index=True).sort_values('person', ignore_index=True)
+    parts = combine_summary_parts([result[1] for result in results])
+    all_records_1, all_records_2, freight_removed_1, freight_removed_2 = np.sum([result[2] for result in results], axis=0)
+    logging.info(f"Primary mode comparison: {int(comparison['mode_changed'].sum())} persons changed mode")
+
+    write_summary_file(
+        parts,
+        output_path=output_path,
+        first_file_name=first_file_name,
+        second_file_name=second_file_name,
+        all_df_1_records=int(all_records_1),
+        all_df_2_records=int(all_records_2),
+        df_freight_removed_1=int(freight_removed_1),
+        df_freight_removed_2=int(freight_removed_2)
+    )
     return comparison
 
 
@@ -513,6 +885,17 @@ if __name__ == "__main__":
         sim_output_folder_1 = config.get(section, '1_sim_output_folder')
         sim_output_folder_2 = config.get(section, '2_sim_output_folder')
         clean_csv_folder = config.get('config', 'clean_csv_folder')
+        # Optional: several scenarios compared with 1_sim_output_folder as baseline (comma separated trips files)
+        scenario_files = [f.strip() for f in config.get(section, 'scenario_sim_output_folders', fallback='').split(',')
+                          if f.strip()]
+        # Optional: out-of-core comparison, both files split by person into comparison_buckets buckets on disk
+        comparison_buckets = config.getint(section, 'comparison_buckets', fallback=0)
+        comparison_workers = config.getint(section, 'comparison_workers', fallback=1)
+        comparison_bucket_folder = config.get(section, 'comparison_bucket_folder', fallback='')
+        # Optional: trip-level diff, trips aligned by trip_number or by departure order within each person
+        trip_alignment = config.get(section, 'trip_diff_align_by', fallback='').strip() or None
+        if trip_alignment and trip_alignment not in TRIP_ALIGNMENTS:
+            raise ValueError(f"trip_diff_align_by must be one of {TRIP_ALIGNMENTS}, got '{trip_alignment}'")
     except Exception as e:
         logging.error("Error reading config file: " + str(e))
         sys.exit(1)
@@ -550,15 +933,45 @@ if __name__ == "__main__":
     logging.info("=" * 60)
 
     try:
-        results = analyze_transport_modes(
-            sim_output_folder_1,
-            sim_output_folder_2,
-            detailed_expanded=False,
-            nrows=comparison_num_rows,
-            output_path=compare_simulations_dir,
-            first_file_name=first_file_name,
-            second_file_name=second_file_name
-        )
+        if scenario_files:
+            if comparison_buckets > 1:
+                logging.warning("comparison_buckets is not used with scenario_sim_output_folders: "
+                                "the scenarios are compared in memory")
+            # The baseline is loaded once for all the scenarios
+            scenario_results = compare_scenarios(
+                sim_output_folder_1,
+                scenario_files,
+                nrows=comparison_num_rows,
+                output_path=compare_simulations_dir,
+                baseline_name=first_file_name,
+                trip_alignment=trip_alignment
+            )
+            results = pd.concat(scenario_results.values(), ignore_index=True)
+        elif comparison_buckets > 1:
+            if trip_alignment:
+                logging.warning("The trip diff is not written by the partitioned comparison (comparison_buckets > 1)")
+            results = analyze_transport_modes_partitioned(
+                sim_output_folder_1,
+                sim_output_folder_2,
+                n_buckets=comparison_buckets,
+                workers=comparison_workers,
+                nrows=comparison_num_rows,
+                output_path=compare_simulations_dir,
+                first_file_name=first_file_name,
+                second_file_name=second_file_name,
+                bucket_folder=comparison_bucket_folder
+            )
+        else:
+            results = analyze_transport_modes(
+                sim_output_folder_1,
+                sim_output_folder_2,
+                detailed_expanded=False,
+                nrows=comparison_num_rows,
+                output_path=compare_simulations_dir,
+                first_file_name=first_file_name,
+                second_file_name=second_file_name,
+                trip_alignment=trip_alignment
+            )
 
         overall_end_time = datetime.now()
         total_secs = time.time() - overall_start_ts
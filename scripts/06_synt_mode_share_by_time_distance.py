@@ -5,6 +5,7 @@ calculates trip midpoints, and saves information including mode, time, distance,
 # Import necessary libraries
 import matsim
 from functions.commonFunctions import *
+from functions.intermediate_store import read_table, write_table
 import pandas as pd
 
 pd.set_option('display.max_columns', 500)
@@ -40,9 +41,9 @@ if __name__ == '__main__':
     # Read csv files - ToCheck if folder changes to clean_csv_folder
     if read_SynPop:
         try:
-            df_routes_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_routes_synt.csv"))
-            df_legs_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_legs_synt.csv"))
-            df_activity_synt = pd.read_csv(os.path.join(pre_processed_data_path, "df_activity_synt.csv"))
+            df_routes_synt = read_table(os.path.join(pre_processed_data_path, "df_routes_synt.csv"))
+            df_legs_synt = read_table(os.path.join(pre_processed_data_path, "df_legs_synt.csv"))
+            df_activity_synt = read_table(os.path.join(pre_processed_data_path, "df_activity_synt.csv"))
             logging.info("Synthetic CSV files loaded successfully.")
         except Exception as e:
             logging.error(f"Error reading synthetic CSV files: {str(e)}")
@@ -65,5 +66,5 @@ if __name__ == '__main__':
             lambda row: compute_avg_coordinates(row["start_link"], row["end_link"], link_dict_synt_str), axis=1,
             result_type="expand")
 
-        df_synt_mode_share_time_distance.to_csv(os.path.join(pre_processed_data_path, "travel_time_distance_mode_synt.csv"), index=False)
+        write_table(df_synt_mode_share_time_distance, os.path.join(pre_processed_data_path, "travel_time_distance_mode_synt.csv"))
         logging.info("Dataframe saved as csv file successfully")
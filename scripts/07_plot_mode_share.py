@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from datetime import datetime
 from functions.commonFunctions import *
+from functions.trip_flags import read_subset
 from functools import reduce
 
 pd.set_option('display.max_columns', None)
@@ -61,7 +62,7 @@ def filter_out_modes(df, mode_col='mode', modes_to_exclude=None):
 
 
 def load_and_prepare_data(file_path, mode_col='mode', modes_to_exclude=None):
-    df = pd.read_csv(file_path)
+    df = read_subset(file_path)
     if mode_col in df.columns:
         df[mode_col] = df[mode_col].astype(str).str.replace('_', ' ').str.title()
         df = filter_out_modes(df, mode_col, modes_to_exclude)
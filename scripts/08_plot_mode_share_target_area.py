@@ -11,6 +11,7 @@ from datetime import datetime
 import pandas as pd
 from functools import reduce
 from functions.commonFunctions import *
+from functions.trip_flags import read_subset
 
 pd.set_option('display.max_columns', 100)
 pd.set_option('display.max_rows', 100)
@@ -64,7 +65,7 @@ def filter_out_modes(df, mode_col='mode', modes_to_exclude=None):
 
 
 def load_and_prepare_data(file_path, target_area_gdf, both_in, x_col, y_col, mode_col='mode', modes_to_exclude=None):
-    df = pd.read_csv(file_path)
+    df = read_subset(file_path)
     if mode_col in df.columns:
         df[mode_col] = df[mode_col].astype(str).str.replace('_', ' ').str.title()
         df = filter_out_modes(df, mode_col, modes_to_exclude)
@@ -9,6 +9,7 @@ import plotly.graph_objects as go
 import geopandas as gpd
 from shapely.geometry import Point
 from functions.commonFunctions import *
+from functions.intermediate_store import read_table
 import warnings
 
 pd.set_option('display.max_columns', 100)
@@ -36,11 +37,11 @@ if __name__ == '__main__':
     ]
 
     pre_processed_data_path = os.path.join(data_path, analysis_zone_name, csv_folder, percentile)
-    df_synt_mode_share = pd.read_csv(os.path.join(pre_processed_data_path, "travel_time_distance_mode_synt.csv"))
+    df_synt_mode_share = read_table(os.path.join(pre_processed_data_path, "travel_time_distance_mode_synt.csv"))
     logging.info(
         f"Read {len(df_synt_mode_share)} rows from {os.path.join(pre_processed_data_path, 'travel_time_distance_mode_synt.csv')}")
 
-    df_sim_mode_share = pd.read_csv(os.path.join(pre_processed_data_path, "travel_time_distance_mode_sim.csv"))
+    df_sim_mode_share = read_table(os.path.join(pre_processed_data_path, "travel_time_distance_mode_sim.csv"))
     logging.info(
         f"Read {len(df_sim_mode_share)} rows from {os.path.join(pre_processed_data_path, 'travel_time_distance_mode_sim.csv')}")
 
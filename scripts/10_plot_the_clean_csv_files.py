@@ -6,6 +6,7 @@ import warnings
 import matplotlib.pyplot as plt
 from datetime import datetime
 from functions.commonFunctions import *
+from functions.intermediate_store import read_table
 from functools import reduce
 
 pd.set_option('display.max_columns', None)
@@ -13,7 +14,7 @@ pd.set_option('display.max_rows', None)
 warnings.filterwarnings('ignore')
 
 def load_population_data(file_path):
-    df = pd.read_csv(file_path)
+    df = read_table(file_path)
     df['sex'] = df['sex'].replace({0: 'Male', 1: 'Female', 'male': 'Male', 'female': 'Female'})
     if 'number_of_cars' in df.columns:
         df['number_of_cars'] = df['number_of_cars'].astype(str)
@@ -140,7 +141,7 @@ def main():
 
     df_population_mic = load_population_data(os.path.join(data_path, analysis_zone_name,clean_csv_folder,percentile, "population_at_least_one_activity_inside_mic.csv"))
     df_population_sim = load_population_data(os.path.join(data_path_clean, "population_all_activities_inside_sim.csv"))
-    df_households_sim = pd.read_csv(os.path.join(data_path_clean, "households_all_activities_inside_sim.csv"))
+    df_households_sim = read_table(os.path.join(data_path_clean, "households_all_activities_inside_sim.csv"))
 
     plot_gender_distribution(df_population_mic, df_population_sim, plots_directory)
     plot_car_ownership(df_population_mic, df_households_sim, plots_directory)
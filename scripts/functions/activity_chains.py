@@ -0,0 +1,66 @@
+"""
+Activity chains (e.g. H-W-S-H) of persons or plans, built from categorical codes instead of a '-'.join per group.
+
+The rows are sorted once by group (PersonLayout), the activities are reduced to the codes of their first
+letters, and the groups with the same code sequence are found per chain length with one np.unique over a code
+matrix. Each distinct chain is joined to a string only once: the result is an integer chain id per group and
+a sorted chain dictionary (chain id -> chain string).
+"""
+import numpy as np
+import pandas as pd
+
+from functions.person_sequences import PersonLayout
+
+MISSING_LETTER = '?'
+
+
+def build_chains(df, group_column, label_column, prefix=None, upper=False):
+    """
+    Chains of the groups of df, the activities being taken in the order of the rows.
+
+    :param df: DataFrame with one row per activity (or trip).
+    :param group_column: Column of the persons or plans, rows with a missing group are ignored.
+    :param label_column: Column whose first letter is used for each activity (e.g. 'type' or 'purpose').
+    :param prefix: Letter added at the start of each chain (e.g. 'H' for the home of the microcensus trips).
+    :param upper: Use the upper case first letters.
+    :return: (sorted group keys, chain id of each group, chain dictionary array)
+    """
+    # Rows sorted by group (stable: the activity order of each group is kept), with the offsets of each group
+    layout = PersonLayout(df[group_column])
+    keys, lengths, offsets = layout.persons, layout.counts, layout.offsets
+
+    # First letter of each label category, then code of each row in the (small) letter alphabet
+    labels = pd.Categorical(df[label_column])
+    category_letters = [str(category)[0] for category in labels.categories]
+    if upper:
+        category_letters = [letter.upper() for letter in category_letters]
+    letter_codes, alphabet = pd.factorize(pd.Index(category_letters + [MISSING_LETTER]))
+    row_letters = layout.sorted(letter_codes[np.where(labels.codes < 0, len(category_letters), labels.codes)])
+
+    # Distinct code sequences, per chain length
+    group_chains = np.empty(len(keys), dtype=np.int64)
+    chain_strings = []
+    for length in np.unique(lengths):
+        groups = np.flatnonzero(lengths == length)
+        matrix = row_letters[offsets[groups][:, np.newaxis] + np.arange(length)]
+        sequences, inverse = np.unique(matrix, axis=0, return_inverse=True)
+        group_chains[groups] = len(chain_strings) + inverse.reshape(-1)
+        chain_strings.extend('-'.join(([prefix] if prefix else []) + [alphabet[code] for code in sequence])
+                             for sequence in sequences)
+
+    # Chain ids in the alphabetical order of the chains
+    chains, chain_ids = np.unique(np.array(chain_strings, dtype=object), return_inverse=True)
+    return keys, chain_ids.reshape(-1)[group_chains], chains
+
+
+def activity_chains(df, group_column, label_column, prefix=None, upper=False):
+    """Table with one activity_chain per group, same as a groupby(group_column) with a '-'.join per group."""
+    keys, chain_ids, chains = build_chains(df, group_column, label_column, prefix, upper)
+    return pd.DataFrame({group_column: keys, 'activity_chain': chains[chain_ids]})
+
+
+def chain_frequencies(df_chains, column='activity_chain'):
+    """Number and share of the groups of each chain, sorted by chain, to compare the datasets with a join on the chain."""
+    frequencies = df_chains[column].value_counts().sort_index().rename_axis(column).reset_index(name='count')
+    frequencies['share'] = frequencies['count'] / frequencies['count'].sum()
+    return frequencies
@@ -26,14 +26,20 @@ def get_log_filename():
     return log_filename
 
 
-def read_config(path='config.ini'):
+def load_config(path='config.ini'):
+    # Returns the parsed config, to read the optional settings that are not part of read_config
     directory = os.getcwd()
     parent_directory = os.path.dirname(directory)
 
+    config = configparser.ConfigParser()
+    config_path = os.path.join(parent_directory, 'config', path)
+    config.read(config_path)
+    return config
+
+
+def read_config(path='config.ini'):
     try:
-        config = configparser.ConfigParser()
-        config_path = os.path.join(parent_directory, 'config', path)
-        config.read(config_path)
+        config = load_config(path)
 
         data_path = config['config']['data_path']
         simulation_zone_name = config['config']['simulation_zone_name']
@@ -0,0 +1,56 @@
+"""
+Households of output_households.xml.gz as two tables: the households and the exploded household -> person members.
+
+The members table has one row per (household row, person id) with integer columns, so the households of a set
+of persons are selected with one vectorized isin instead of a loop over the member lists. Both tables are
+cached in a pickle keyed by the checksum of the xml file: the next runs skip the xml parsing.
+"""
+import ast
+import itertools
+import logging
+import os
+
+import matsim
+import numpy as np
+import pandas as pd
+
+from functions.microcensus_loader import file_checksum
+
+HOUSEHOLDS_CACHE = 'households_members.pkl'
+
+
+def explode_members(households):
+    """One row per member: household_index (row position in households) and person_id."""
+    # The members are lists of ids, or their string form when the households were read back from a csv
+    members = households['members'].map(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
+    lengths = members.map(len).to_numpy()
+    person_ids = np.fromiter(itertools.chain.from_iterable(members), dtype=np.int64, count=lengths.sum())
+    return pd.DataFrame({
+        'household_index': np.repeat(np.arange(len(households), dtype=np.int64), lengths),
+        'person_id': person_ids,
+    })
+
+
+def load_households(households_file, cache_folder):
+    """Households and members tables of a MATSim households file, from the cache if the file did not change."""
+    checksum = file_checksum(households_file)
+    cache_path = os.path.join(cache_folder, HOUSEHOLDS_CACHE)
+    if os.path.exists(cache_path):
+        cached = pd.read_pickle(cache_path)
+        if cached['source'] == households_file and cached['checksum'] == checksum:
+            logging.info(f"Households read from the cache {cache_path}")
+            return cached['households'], cached['members']
+
+    households = matsim.household_reader(households_file).households
+    members = explode_members(households)
+
+    os.makedirs(cache_folder, exist_ok=True)
+    pd.to_pickle({'source': households_file, 'checksum': checksum, 'households': households, 'members': members}, cache_path)
+    logging.info(f"Households parsed and cached to {cache_path}")
+    return households, members
+
+
+def households_of_persons(households, members, person_ids):
+    """Households (in their order) having at least one member in person_ids."""
+    selected = members['household_index'].to_numpy()[members['person_id'].isin(person_ids).to_numpy()]
+    return households.iloc[np.unique(selected)]
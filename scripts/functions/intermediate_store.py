@@ -0,0 +1,349 @@
+"""
+Read and write the intermediate tables passed between the stages (csv_folder and clean_csv_folder).
+
+The format is chosen with intermediate_format in the [config] section of config.ini:
+    intermediate_format = csv      (default) the files are written and read as today
+    intermediate_format = parquet  typed, zstd compressed columnar files (needs pyarrow)
+
+The scripts keep using the csv file names (e.g. df_activity_sim.csv), in parquet mode the extension is
+swapped to .parquet. If a parquet file does not exist yet, the csv file is read instead, so stages that
+were run before the switch (e.g. the microcensus ones) can still be used.
+"""
+import logging
+import os
+from functools import lru_cache
+
+import pandas as pd
+
+from functions.commonFunctions import load_config
+
+INTERMEDIATE_FORMATS = ('csv', 'parquet')
+PARQUET_COMPRESSION = 'zstd'
+
+# Column types of the intermediate tables, by column name. Columns not listed keep the inferred type.
+# Person ids are int64 when every id is numeric, else strings (e.g. with the freight agents of the simulation).
+ID_COLUMNS = ['person', 'person_id']
+CATEGORICAL_COLUMNS = ['mode', 'main_mode', 'longest_distance_mode', 'routingMode', 'type', 'purpose']
+INTEGER_COLUMNS = ['id', 'plan_id', 'leg_id', 'trip_id', 'trip_number', 'flags']
+FLOAT_COLUMNS = [
+    'x', 'y', 'start_x', 'start_y', 'end_x', 'end_y', 'home_x', 'home_y',
+    'origin_x', 'origin_y', 'destination_x', 'destination_y',
+    'start_coor_x', 'start_coor_y', 'ziel_coor_x', 'ziel_coor_y',
+    'distance', 'euclidean_distance', 'traveled_distance', 'crowfly_distance', 'network_distance',
+    'household_weight', 'person_weight',
+]
+
+
+@lru_cache(maxsize=None)
+def get_intermediate_format():
+    intermediate_format = load_config().get('config', 'intermediate_format', fallback='csv').strip().lower()
+    if intermediate_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"intermediate_format must be one of {INTERMEDIATE_FORMATS}, not '{intermediate_format}'")
+    return intermediate_format
+
+
+def table_path(file_path, fmt=None):
+    """Path of the table in the given format, file_path being the csv path used by the scripts."""
+    fmt = fmt or get_intermediate_format()
+    root, _ = os.path.splitext(file_path)
+    return f"{root}.{fmt}"
+
+
+def id_column(values):
+    """Person ids as int64 (Int64 if some are missing) when they are all integer numbers, else as strings."""
+    try:
+        numeric = pd.to_numeric(values)
+        if numeric.dtype.kind == 'f' and not (numeric.dropna() % 1 == 0).all():
+            raise ValueError("non-integer ids")
+        return numeric.astype('int64') if numeric.notna().all() else numeric.astype('Int64')
+    except (ValueError, TypeError):
+        return values.where(values.isna(), values.astype(str))
+
+
+def normalize_ids(df):
+    """Same person id type whatever the file format."""
+    ids = {column: id_column(df[column]) for column in ID_COLUMNS if column in df.columns}
+    return df.assign(**ids) if ids else df
+
+
+def infer_string_columns(df):
+    """
+    Types of the columns stored as strings in the parquet files (the untyped columns of the chunked files),
+    inferred like read_csv does: numbers, booleans, else strings.
+    """
+    inferred = {}
+    for column in df.columns:
+        if column in ID_COLUMNS or column in CATEGORICAL_COLUMNS or df[column].dtype != object:
+            continue
+        values = df[column]
+        present = values.dropna()
+        if present.empty:
+            continue
+        if present.isin(['True', 'False']).all():
+            inferred[column] = values.map({'True': True, 'False': False}) if len(present) < len(values) \
+                else values == 'True'
+            continue
+        try:
+            inferred[column] = pd.to_numeric(values)
+        except (ValueError, TypeError):
+            pass
+    return df.assign(**inferred) if inferred else df
+
+
+def apply_schema(df, categorical=True, keep_as_string=()):
+    """
+    Cast the known columns: integer ids, float coordinates/distances and (if categorical) categorical modes.
+    Columns that cannot be converted are left as they are.
+    """
+    converted = {}
+    for column in INTEGER_COLUMNS:
+        if column in df.columns and column not in keep_as_string:
+            try:
+                converted[column] = pd.to_numeric(df[column]).astype('int64')
+            except (ValueError, TypeError):
+                logging.info(f"Column '{column}' is not an integer column, kept as it is")
+    for column in FLOAT_COLUMNS:
+        if column in df.columns and column not in keep_as_string:
+            try:
+                converted[column] = pd.to_numeric(df[column]).astype('float64')
+            except (ValueError, TypeError):
+                logging.info(f"Column '{column}' is not a float column, kept as it is")
+    if categorical:
+        for column in CATEGORICAL_COLUMNS:
+            if column in df.columns and column not in keep_as_string:
+                converted[column] = df[column].astype('category')
+    return df.assign(**converted) if converted else df
+
+
+def write_table(df, file_path, fmt=None):
+    fmt = fmt or get_intermediate_format()
+    path = table_path(file_path, fmt)
+    if fmt == 'parquet':
+        df = normalize_ids(apply_schema(df))
+        try:
+            df.to_parquet(path, index=False, compression=PARQUET_COMPRESSION)
+        except (TypeError, ValueError) as e:
+            # Object columns mixing strings and numbers (e.g. number_of_cars with '3+') are stored as strings
+            logging.info(f"Storing the mixed object columns of {path} as strings: {e}")
+            mixed = {column: df[column].where(df[column].isna(), df[column].astype(str))
+                     for column in df.columns if df[column].dtype == object}
+            df.assign(**mixed).to_parquet(path, index=False, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(path, index=False)
+    logging.info(f"Table saved to {path}")
+    return path
+
+
+def resolve_table(file_path, fmt=None):
+    """Format and path of the table to read: the csv file if the parquet one does not exist yet."""
+    fmt = fmt or get_intermediate_format()
+    path = table_path(file_path, fmt)
+    if fmt == 'parquet' and not os.path.exists(path) and os.path.exists(table_path(file_path, 'csv')):
+        logging.info(f"{path} not found, reading the csv file instead")
+        fmt, path = 'csv', table_path(file_path, 'csv')
+    return fmt, path
+
+
+def parquet_batches(path, columns=None, batch_size=None, nrows=None):
+    """Record batches of a parquet file as dataframes, at most nrows rows in total."""
+    import pyarrow.parquet as pq
+
+    remaining = nrows
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size or nrows or 65536, columns=columns):
+        df = batch.to_pandas()
+        if remaining is not None:
+            df = df.iloc[:remaining]
+            remaining -= len(df)
+        yield df
+        if remaining is not None and remaining <= 0:
+            return
+
+
+def restore_types(df):
+    """Types of a table read from parquet, the same as the ones of the csv file read with read_csv."""
+    df = normalize_ids(infer_string_columns(df))
+    # Chunked files store the categorical columns as plain strings
+    categorical = {column: df[column].astype('category') for column in CATEGORICAL_COLUMNS
+                   if column in df.columns and df[column].dtype == object}
+    return df.assign(**categorical) if categorical else df
+
+
+def read_table(file_path, columns=None, fmt=None, nrows=None):
+    """
+    Read an intermediate table, optionally only the given columns and the first nrows rows.
+    """
+    fmt, path = resolve_table(file_path, fmt)
+    if fmt == 'parquet':
+        if nrows is None:
+            df = pd.read_parquet(path, columns=columns)
+        else:
+            df = pd.concat(list(parquet_batches(path, columns, nrows=nrows)), ignore_index=True)
+        return restore_types(df)
+    return normalize_ids(pd.read_csv(path, usecols=columns, nrows=nrows, low_memory=False))
+
+
+def read_table_chunks(file_path, chunk_size, columns=None, fmt=None, nrows=None):
+    """
+    Read an intermediate table chunk_size rows at a time. The columns are not typed: the ids and the
+    untyped columns can be strings (person ids are to be normalised by the caller).
+    """
+    fmt, path = resolve_table(file_path, fmt)
+    if fmt == 'parquet':
+        yield from parquet_batches(path, columns, batch_size=chunk_size, nrows=nrows)
+    else:
+        yield from pd.read_csv(path, usecols=columns, dtype=str, nrows=nrows, chunksize=chunk_size)
+
+
+class ChunkedCsvWriter:
+    """
+    Collects rows column by column and appends them to a csv file every chunk_size rows.
+    The columns are the union of the columns of all the rows, in their order of appearance: a column first
+    found after the header was written is added to the next chunks, and the file is rewritten once with
+    the full header in close() (the earlier rows get empty values).
+    """
+
+    def __init__(self, file_path, chunk_size, base_columns=()):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.columns = list(base_columns)
+        self.buffer = {column: [] for column in self.columns}
+        self.n_buffered = 0
+        self.n_written = 0
+        self.header_written = False
+        self.header_columns = []
+
+    def add_column(self, column):
+        if self.header_written:
+            logging.info(f"Column '{column}' first found after the header of {self.file_path} was written, "
+                         f"added to the header when the file is closed")
+        self.columns.append(column)
+        self.buffer[column] = [None] * self.n_buffered
+
+    def append(self, row):
+        for column in row:
+            if column not in self.buffer:
+                self.add_column(column)
+
+        for column in self.columns:
+            self.buffer[column].append(row.get(column))
+        self.n_buffered += 1
+
+        if self.n_buffered >= self.chunk_size:
+            self.flush()
+
+    def write_chunk(self, df_chunk):
+        df_chunk.to_csv(self.file_path, mode='a' if self.header_written else 'w',
+                        header=not self.header_written, index=False)
+        if not self.header_written:
+            self.header_columns = list(df_chunk.columns)
+
+    def flush(self):
+        # An empty table still gets its header, like an empty dataframe written with to_csv
+        if self.n_buffered == 0 and self.header_written:
+            return
+        self.write_chunk(pd.DataFrame(self.buffer, columns=self.columns))
+        self.header_written = True
+        self.n_written += self.n_buffered
+        self.buffer = {column: [] for column in self.columns}
+        self.n_buffered = 0
+
+    def append_dataframe(self, df_chunk):
+        """Append a whole dataframe, its new columns are added like the ones of append."""
+        if self.n_buffered:
+            self.flush()
+        for column in df_chunk.columns:
+            if column not in self.buffer:
+                self.add_column(column)
+        # The types are taken from the first rows, empty chunks are not written (close writes the header if needed)
+        if df_chunk.empty:
+            return
+        self.write_chunk(df_chunk.reindex(columns=self.columns))
+        self.header_written = True
+        self.n_written += len(df_chunk)
+
+    def rewrite_header(self):
+        """
+        Rewrite the file with the full header. The new columns are always after the ones of the header,
+        so the earlier (shorter) rows are read with empty values for them.
+        """
+        temporary_path = f"{self.file_path}.tmp"
+        header = True
+        for chunk in pd.read_csv(self.file_path, names=self.columns, skiprows=1, dtype=str, keep_default_na=False,
+                                 chunksize=max(self.chunk_size, 1)):
+            chunk.to_csv(temporary_path, mode='w' if header else 'a', header=header, index=False)
+            header = False
+        if header:
+            pd.DataFrame(columns=self.columns).to_csv(temporary_path, index=False)
+        os.replace(temporary_path, self.file_path)
+
+    def close(self):
+        self.flush()
+        if self.header_written and self.columns != self.header_columns:
+            logging.info(f"Rewriting {self.file_path} with the columns found after the first chunk: "
+                         f"{self.columns[len(self.header_columns):]}")
+            self.rewrite_header()
+            self.header_columns = list(self.columns)
+        return self.n_written
+
+
+class ChunkedParquetWriter(ChunkedCsvWriter):
+    """
+    Same as ChunkedCsvWriter, but writes parquet. Every chunk is written to a part file (with the columns
+    known so far), and close() combines the parts into the parquet file with the union of their columns,
+    the columns missing in a part being null. The type of each column is fixed where it first appears,
+    the untyped columns are stored as strings.
+    """
+
+    def __init__(self, file_path, chunk_size, base_columns=(), keep_as_string=()):
+        super().__init__(file_path, chunk_size, base_columns)
+        self.keep_as_string = keep_as_string
+        self.fields = {}
+        self.part_paths = []
+
+    def write_chunk(self, df_chunk):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        df_chunk = apply_schema(df_chunk, categorical=False, keep_as_string=self.keep_as_string)
+        # Categories differ from chunk to chunk, they are stored as strings and restored by read_table
+        df_chunk = df_chunk.assign(**{column: df_chunk[column].astype(object) for column in df_chunk.columns
+                                      if isinstance(df_chunk[column].dtype, pd.CategoricalDtype)})
+        typed = INTEGER_COLUMNS + FLOAT_COLUMNS
+        for column in df_chunk.columns:
+            if column not in self.fields:
+                self.fields[column] = pa.field(
+                    column, pa.Table.from_pandas(df_chunk[[column]], preserve_index=False).schema.field(column).type
+                    if column in typed and column not in self.keep_as_string else pa.string())
+        schema = pa.schema([self.fields[column] for column in df_chunk.columns])
+
+        part_path = f"{self.file_path}.part{len(self.part_paths)}"
+        pq.write_table(pa.Table.from_pandas(df_chunk, schema=schema, preserve_index=False), part_path,
+                       compression=PARQUET_COMPRESSION)
+        self.part_paths.append(part_path)
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.flush()
+        if not self.part_paths:
+            return self.n_written
+
+        # One row group per part, with the columns of all the parts
+        schema = pa.schema([self.fields[column] for column in self.columns])
+        with pq.ParquetWriter(self.file_path, schema, compression=PARQUET_COMPRESSION) as writer:
+            for part_path in self.part_paths:
+                part = pq.read_table(part_path)
+                columns = [part.column(field.name) if field.name in part.column_names
+                           else pa.nulls(part.num_rows, type=field.type) for field in schema]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                os.remove(part_path)
+        self.part_paths = []
+        return self.n_written
+
+
+def open_chunked_writer(file_path, chunk_size, base_columns=(), keep_as_string=(), fmt=None):
+    fmt = fmt or get_intermediate_format()
+    if fmt == 'parquet':
+        return ChunkedParquetWriter(table_path(file_path, fmt), chunk_size, base_columns, keep_as_string)
+    return ChunkedCsvWriter(table_path(file_path, fmt), chunk_size, base_columns)
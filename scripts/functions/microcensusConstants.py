@@ -46,3 +46,87 @@ POPULATION_DENSITY_RADIUS = 2.5 * 1e3
 
 BASE_SCALING_YEAR = 2015
 BASE_PROJECTED_YEAR = 2018
+
+
+# MICROCENSUS CODE TABLES (code -> value), applied with recode (process_microcensus.py)
+# Marital status (zivil)
+ZIVIL_TO_MARITAL_STATUS = {
+    1: MARITAL_STATUS_SINGLE,
+    2: MARITAL_STATUS_MARRIED,
+    3: MARITAL_STATUS_SEPARATE,
+    4: MARITAL_STATUS_SEPARATE,
+    5: MARITAL_STATUS_SINGLE,
+    6: MARITAL_STATUS_MARRIED,
+    7: MARITAL_STATUS_SEPARATE,
+}
+
+# Car availability (f42100e), the other codes are "never"
+F42100E_TO_CAR_AVAILABILITY = {
+    1: CAR_AVAILABILITY_ALWAYS,
+    2: CAR_AVAILABILITY_SOMETIMES,
+    3: CAR_AVAILABILITY_NEVER,
+}
+
+# Highest education (HAUSB)
+HAUSB_TO_EDUCATION = {
+    **{code: "primary" for code in [1, 2, 3, 4]},
+    **{code: "secondary" for code in [5, 6, 7, 8, 9, 10, 11, 12]},
+    **{code: "tertiary_professional" for code in [13, 14, 15, 16]},
+    **{code: "tertiary_academic" for code in [17, 18, 19]},
+}
+
+# Parking at work (f41300) and at the place of education (f41301), the other codes are "unknown"
+PARKING_TYPES = {
+    1: "free",
+    2: "paid",
+    3: "no",
+}
+
+# Day of the observation (tag), 6 and 7 are the weekend
+TAG_TO_WEEKEND = {
+    6: True,
+    7: True,
+}
+
+# Main mode of the trip (wmittel)
+WMITTEL_TO_MODE = {
+    -99: "unknown",  # Pseudo stage
+    1: "pt",  # Plane
+    2: "pt",  # Train
+    3: "pt",  # Postauto
+    4: "pt",  # Ship
+    5: "pt",  # Tram
+    6: "pt",  # Bus
+    7: "pt",  # other PT
+    8: "pt",  # Reisecar -> I think this is a coach in Swiss German?
+    9: "car",  # Car
+    10: "car",  # Truck
+    11: "pt",  # Taxi
+    12: "car",  # Motorbike
+    13: "car",  # Mofa
+    14: "bike",  # Bicycle / E-bike
+    15: "walk",  # Walking
+    16: "car",  # "Machines similar to a vehicle"
+    17: "unknown",  # Other / don't know
+}
+WMITTEL_TO_MODE_DETAILED = {**WMITTEL_TO_MODE, 1: "plane", 11: "taxi"}
+
+# Purpose of the trip (wzweck1)
+WZWECK1_TO_PURPOSE = {
+    -99: "unknown",  # Pseudo stage
+    -98: "unknown",  # No answer
+    -97: "unknown",  # Don't know
+    1: "interaction",  # Transfer, change of mode, park car
+    2: "work",  # Work
+    3: "education",  # Education
+    4: "shop",  # Shopping
+    5: "other",  # Chores, use of public services
+    6: "work",  # Business activity
+    7: "work",  # Business trip
+    8: "leisure",  # Leisure
+    9: "other",  # Bring children
+    10: "other",  # Bring others (disabled, ...)
+    11: "home",  # Return home
+    12: "unknown",  # Other
+    13: "border",  # Going out of country
+}
@@ -0,0 +1,63 @@
+"""
+Cached loader for the microcensus csv files of the microzensus folder (wege.csv, etappen.csv, haushalte.csv, ...).
+
+Only the requested columns are parsed (latin1), the ids get fixed integer dtypes, and the parsed table is
+cached as a pickle in microzensus/cache, keyed by the checksum of the source csv and by the requested
+columns. The next runs, and the other stages asking for the same columns, read the pickle instead of
+parsing the csv again. A changed source file has another checksum and is parsed again.
+"""
+import hashlib
+import logging
+import os
+
+import pandas as pd
+
+MICROCENSUS_ENCODING = "latin1"
+CACHE_FOLDER = "cache"
+
+# Columns always read with a fixed dtype (the other columns keep the type inferred by pandas)
+MICROCENSUS_DTYPES = {
+    "HHNR": "int64",
+    "WEGNR": "int64",
+    "ETNR": "int64",
+}
+
+
+def file_checksum(file_path, block_size=1 << 20):
+    checksum = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def load_microcensus(microcensus_path, file_name, columns, parse_dates=None):
+    """
+    Read the given columns of a microcensus csv file, in the given order.
+
+    :param microcensus_path: Path to the microzensus folder.
+    :param file_name: Name of the csv file, e.g. "wege.csv".
+    :param columns: Columns to read.
+    :param parse_dates: Columns to parse as dates, as in pd.read_csv.
+    :return: DataFrame with the requested columns.
+    """
+    columns = list(columns)
+    source_path = os.path.join(microcensus_path, file_name)
+    columns_key = hashlib.sha1(repr((sorted(columns), parse_dates)).encode()).hexdigest()[:10]
+    cache_path = os.path.join(microcensus_path, CACHE_FOLDER, f"{os.path.splitext(file_name)[0]}_{columns_key}.pkl")
+    checksum = file_checksum(source_path)
+
+    if os.path.exists(cache_path):
+        cached = pd.read_pickle(cache_path)
+        if cached["checksum"] == checksum:
+            logging.info(f"{file_name} read from the cache {cache_path}")
+            return cached["table"]
+
+    df = pd.read_csv(source_path, sep=",", encoding=MICROCENSUS_ENCODING, usecols=columns, parse_dates=parse_dates,
+                     dtype={column: dtype for column, dtype in MICROCENSUS_DTYPES.items() if column in columns})
+    df = df[columns]
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    pd.to_pickle({"checksum": checksum, "table": df}, cache_path)
+    logging.info(f"{file_name} parsed and cached to {cache_path}")
+    return df
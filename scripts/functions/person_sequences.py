@@ -0,0 +1,134 @@
+"""
+Vectorized operations on the rows of each person, ordered by a sequence column (trip_id, trip_number, ...).
+
+PersonLayout sorts the rows once by integer person code (CSR layout: the rows of person i are
+order[offsets[i]:offsets[i + 1]]) and gives the per-person reductions (first, last, most frequent value,
+cumcount) as array operations on the sorted rows, instead of one groupby over the person ids per step.
+The same layout is reused by all the steps working on the same table.
+"""
+import numpy as np
+import pandas as pd
+
+
+class PersonLayout:
+    """
+    Rows of a table sorted by person (and by order_by within each person, else in their row order).
+
+    persons: sorted distinct person ids, persons[i] has the integer code i
+    codes: person code of each row (-1 for a missing person, these rows are left out of the layout)
+    order: row positions sorted by person, offsets: start of each person in order (length n_persons + 1)
+    """
+
+    def __init__(self, persons, order_by=None):
+        self.codes, self.persons = pd.factorize(persons, sort=True)
+        self.n_rows = len(self.codes)
+        rows = np.flatnonzero(self.codes >= 0)
+        if order_by is None:
+            self.order = rows[np.argsort(self.codes[rows], kind='stable')]
+        else:
+            self.order = rows[np.lexsort((np.asarray(order_by)[rows], self.codes[rows]))]
+        self.counts = np.bincount(self.codes[rows], minlength=len(self.persons))
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)))
+        self.sorted_codes = self.codes[self.order]
+
+    @property
+    def n_persons(self):
+        return len(self.persons)
+
+    def sorted(self, values):
+        """Values of the rows in the layout order."""
+        return np.asarray(values)[self.order]
+
+    def first(self, values):
+        """Value of the first row of each person."""
+        return self.sorted(values)[self.offsets[:-1]]
+
+    def last(self, values):
+        """Value of the last row of each person."""
+        return self.sorted(values)[self.offsets[1:] - 1]
+
+    def next_row(self):
+        """Position in the layout of the next row of the same person, -1 for the last row of each person."""
+        next_position = np.arange(1, len(self.order) + 1)
+        next_position[self.offsets[1:] - 1] = -1
+        return next_position
+
+    def cumcount(self, keys=None):
+        """
+        Number of the row within its person (or within its (person, key) group, like
+        groupby([person, key]).cumcount()), in the row order of the table. -1 for the rows left out
+        and for the rows with a missing key.
+        """
+        key_codes = np.zeros(self.n_rows, dtype=np.int64)
+        n_keys = 1
+        if keys is not None:
+            key_codes, key_values = pd.factorize(keys, sort=True)
+            n_keys = len(key_values) + 1
+        group_codes = self.sorted_codes.astype(np.int64) * n_keys + self.sorted(key_codes)
+        # The layout order is kept within each group (stable sort of the sorted rows)
+        group_order = np.argsort(group_codes, kind='stable')
+        sorted_groups = group_codes[group_order]
+        starts = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+        positions = np.arange(len(sorted_groups))
+        ranks = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+        result = np.full(self.n_rows, -1, dtype=np.int64)
+        result[self.order[group_order]] = ranks
+        result[key_codes < 0] = -1
+        return result
+
+    def argmax_count(self, keys):
+        """
+        Most frequent key of each person, like groupby([person, key]).size() followed by idxmax per person:
+        the ties go to the first key in sorted order. Missing keys are not counted, persons without any
+        key get None.
+        """
+        key_codes, key_values = pd.factorize(keys, sort=True)
+        key_codes = self.sorted(key_codes)
+        valid = key_codes >= 0
+        result = np.full(self.n_persons, None, dtype=object)
+        if not valid.any():
+            return result
+
+        # Counts of the (person, key) pairs, sorted by person then key
+        pairs, pair_counts = np.unique(
+            self.sorted_codes[valid].astype(np.int64) * len(key_values) + key_codes[valid], return_counts=True)
+        pair_persons, pair_keys = np.divmod(pairs, len(key_values))
+
+        # Maximum count of each person, then the first pair (smallest key) reaching it
+        person_starts = np.flatnonzero(np.r_[True, pair_persons[1:] != pair_persons[:-1]])
+        max_counts = np.maximum.reduceat(pair_counts, person_starts)
+        is_max = pair_counts == np.repeat(max_counts, np.diff(np.r_[person_starts, len(pairs)]))
+        first_max = np.minimum.reduceat(np.where(is_max, np.arange(len(pairs)), len(pairs)), person_starts)
+
+        result[pair_persons[first_max]] = np.asarray(key_values, dtype=object)[pair_keys[first_max]]
+        return result
+
+
+def next_in_sequence(df, person_column, order_column, value_column, layout=None):
+    """
+    Value of value_column in the row of the same person with order_column + 1, NaN if there is none.
+    Same result as merging the table with itself on (person, order) = (person, order of the next row - 1).
+    """
+    if layout is None:
+        layout = PersonLayout(df[person_column], order_by=df[order_column])
+    sequence = layout.sorted(df[order_column].to_numpy())
+    values = layout.sorted(df[value_column].to_numpy(dtype=float))
+
+    # The next row is the next one of the same person only if the sequence has no gap
+    next_position = layout.next_row()
+    has_next = next_position >= 0
+    has_next[has_next] = sequence[next_position[has_next]] == sequence[has_next] + 1
+    next_values = np.full(len(values), np.nan)
+    next_values[has_next] = values[next_position[has_next]]
+
+    result = np.full(layout.n_rows, np.nan)
+    result[layout.order] = next_values
+    return result
+
+
+def activity_durations(df, person_column='person_id', order_column='trip_id',
+                       departure_column='departure_time', arrival_column='arrival_time', layout=None):
+    """Activity duration of each trip: arrival time of the next trip of the person minus the departure time."""
+    return (next_in_sequence(df, person_column, order_column, arrival_column, layout)
+            - df[departure_column].to_numpy(dtype=float))
@@ -1,5 +1,11 @@
+import hashlib
+import logging
+import os
+from functools import lru_cache
+
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 from .microcensusConstants import *
 
 
@@ -44,3 +50,66 @@ def fix_marital_status(df):
         (df["marital_status"] == MARITAL_STATUS_SEPARATE) & (df["age"] < SEPARATE_SINGLE_THRESHOLD)
         , "marital_status"] = MARITAL_STATUS_SINGLE
     df.loc[:, "marital_status"] = df.loc[:, "marital_status"].astype(int)
+
+
+# called in 01 and 02
+def recode(series, table, default=np.nan, categorical=False):
+    """
+        Recodes a microcensus field with a code -> value table (see microcensusConstants.py).
+
+        The codes are looked up in one vectorized indexing operation instead of one comparison per code.
+        The codes missing from the table get default. With categorical, the result is a categorical
+        with the (sorted) values of the table as categories.
+    """
+    positions = pd.Index(list(table.keys())).get_indexer(series.to_numpy())
+    # Position -1 (code not in the table) takes the default, appended last
+    values = list(table.values()) + [default]
+
+    if categorical:
+        categories = sorted(set(value for value in values if not pd.isna(value)))
+        category_codes = np.array([-1 if pd.isna(value) else categories.index(value) for value in values])
+        return pd.Series(pd.Categorical.from_codes(category_codes[positions], categories=categories), index=series.index)
+    return pd.Series(pd.Series(values).to_numpy()[positions], index=series.index)
+
+
+@lru_cache(maxsize=None)
+def get_transformer(source_crs=CH1903, target_crs=CH1903_PLUS):
+    """ Transformer shared by all the projections between the same CRS (creating one is slow). """
+    return pyproj.Transformer.from_crs(source_crs, target_crs)
+
+
+# called in 01 and 02
+def project_to_lv95(df, coordinate_columns, cache_file=None):
+    """
+        Projects CH1903 (LV03) coordinates to CH1903+ (LV95).
+
+        coordinate_columns maps a prefix to its (x, y) columns, e.g. {"home": ("W_X_CH1903", "W_Y_CH1903")}.
+        All the pairs are stacked and projected with one transform call. Returns a dict with the
+        projected "<prefix>_x" and "<prefix>_y" arrays, in the order of coordinate_columns.
+
+        With cache_file (.npz), the projected coordinates are saved next to the microcensus tables and
+        reused by the next runs, as long as the source coordinates (checksum) did not change.
+    """
+    source_x = np.concatenate([df[x].to_numpy(dtype=float) for x, _ in coordinate_columns.values()])
+    source_y = np.concatenate([df[y].to_numpy(dtype=float) for _, y in coordinate_columns.values()])
+    checksum = hashlib.sha1(source_x.tobytes() + source_y.tobytes()).hexdigest()
+
+    x = y = None
+    if cache_file is not None and os.path.exists(cache_file):
+        cached = np.load(cache_file)
+        if str(cached["checksum"]) == checksum:
+            x, y = cached["x"], cached["y"]
+            logging.info(f"LV95 coordinates read from {cache_file}")
+
+    if x is None:
+        x, y = get_transformer().transform(source_x, source_y)
+        if cache_file is not None:
+            np.savez(cache_file, checksum=checksum, x=x, y=y)
+            logging.info(f"LV95 coordinates saved to {cache_file}")
+
+    n = len(df)
+    projected = {}
+    for i, prefix in enumerate(coordinate_columns):
+        projected["%s_x" % prefix] = x[i * n:(i + 1) * n]
+        projected["%s_y" % prefix] = y[i * n:(i + 1) * n]
+    return projected
@@ -0,0 +1,55 @@
+"""
+Vectorized point-in-polygon tests on raw coordinate arrays.
+
+The polygon is prepared once and the x/y arrays are tested in one call, without building shapely Point
+objects or GeoSeries. point.within(polygon) is the same test as polygon.contains(point): points lying
+exactly on the boundary are outside.
+"""
+import numpy as np
+import shapely
+
+
+def points_inside(polygon, x, y):
+    """
+    Boolean array, True where the point (x[i], y[i]) is inside the polygon.
+    Only the points inside the bounding box of the polygon are tested against the polygon itself.
+    """
+    if not shapely.is_prepared(polygon):
+        shapely.prepare(polygon)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    min_x, min_y, max_x, max_y = polygon.bounds
+    inside = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+    inside[inside] = shapely.contains_xy(polygon, x[inside], y[inside])
+    return inside
+
+
+def trips_inside_masks(polygon, df, origin_columns=('start_x', 'start_y'), destination_columns=('end_x', 'end_y')):
+    """
+    Masks of the trips with the origin inside and with the destination inside the polygon.
+    Combine them for the O and D (origin & destination) and O or D (origin | destination) filters.
+    """
+    origin_inside = points_inside(polygon, df[origin_columns[0]].to_numpy(), df[origin_columns[1]].to_numpy())
+    destination_inside = points_inside(polygon, df[destination_columns[0]].to_numpy(), df[destination_columns[1]].to_numpy())
+    return origin_inside, destination_inside
+
+
+def points_inside_areas(polygons, x, y):
+    """
+    Boolean array of shape (number of polygons, number of points), True where the point is inside the polygon.
+    The few analysis polygons are tested one after the other on the raw arrays (bounding box first), no
+    Point geometry is created for the points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    inside = np.zeros((len(polygons), len(x)), dtype=bool)
+    for i, polygon in enumerate(polygons):
+        inside[i] = points_inside(polygon, x, y)
+    return inside
+
+
+def trips_inside_area_masks(polygons, df, origin_columns=('start_x', 'start_y'), destination_columns=('end_x', 'end_y')):
+    """Same as trips_inside_masks for several polygons, the masks having one row per polygon."""
+    origin_inside = points_inside_areas(polygons, df[origin_columns[0]].to_numpy(), df[origin_columns[1]].to_numpy())
+    destination_inside = points_inside_areas(polygons, df[destination_columns[0]].to_numpy(), df[destination_columns[1]].to_numpy())
+    return origin_inside, destination_inside
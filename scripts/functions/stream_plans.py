@@ -0,0 +1,162 @@
+"""
+Streaming reader for MATSim plans files (output_plans.xml.gz, population.xml.gz).
+
+matsim.plan_reader_dataframe keeps every person, plan, activity, leg and route as Python dicts
+before building the dataframes. Here the gzip stream is walked element by element, every person
+is freed from the tree once parsed and the rows are appended to the csv files in chunks of
+chunk_size rows, so the memory depends on the chunk size and not on the population size.
+The files are written as csv or parquet, following intermediate_format (see intermediate_store.py).
+
+Ids and column names follow matsim.plan_reader_dataframe, so the written files can replace
+df_activity_*.csv, df_persons_*.csv, ... one to one.
+"""
+import logging
+import xml.etree.ElementTree as ET
+
+import xopen
+
+from functions.intermediate_store import open_chunked_writer
+
+DEFAULT_CHUNK_SIZE = 100000
+
+# Columns always written first, the remaining ones are taken from the xml attributes
+BASE_COLUMNS = {
+    'persons': ['id'],
+    'plans': ['id', 'person_id'],
+    'activities': ['id', 'plan_id'],
+    'legs': ['id', 'plan_id'],
+    'routes': ['id', 'leg_id', 'value'],
+}
+
+
+def _is_freight(person):
+    return str(person.get('isFreight', '')).lower() == 'true'
+
+
+def stream_plans_to_csv(plans_file, output_paths, chunk_size=DEFAULT_CHUNK_SIZE,
+                        selected_plans_only=False, skip_freight=False, skip_plans_with_activity_types=()):
+    """
+    Parse a MATSim plans file and write its tables to csv in chunks.
+
+    The filters are applied while parsing, so the skipped persons and plans are never turned into rows.
+    The ids are counted over the whole file, so the kept rows have the same ids as without filters.
+
+    :param plans_file: Path to the (gzipped) plans xml file.
+    :param output_paths: Dict mapping the tables to write ('persons', 'plans', 'activities', 'legs', 'routes')
+                         to their csv file (.parquet in parquet mode). Tables not in the dict are parsed but not written.
+    :param chunk_size: Number of rows kept in memory per table before appending them to the file.
+    :param selected_plans_only: Skip the plans with selected="no".
+    :param skip_freight: Skip the persons with the attribute isFreight set to true.
+    :param skip_plans_with_activity_types: Skip the whole plan if one of its activities has one of these types
+                                           (e.g. ['outside']).
+    :return: Dict with the number of rows written per table.
+    """
+    unknown_tables = set(output_paths) - set(BASE_COLUMNS)
+    if unknown_tables:
+        raise ValueError(f"Unknown plans tables: {sorted(unknown_tables)}")
+
+    # The person ids are kept as strings, freight agents do not have numeric ids
+    writers = {table: open_chunked_writer(path, chunk_size, BASE_COLUMNS[table],
+                                          keep_as_string=('id',) if table == 'persons' else ())
+               for table, path in output_paths.items()}
+    skip_plans_with_activity_types = set(skip_plans_with_activity_types)
+
+    # Rows of the current person and plan, written only once the person (or the plan) is known to be kept
+    person_rows = {table: [] for table in BASE_COLUMNS}
+    plan_rows = None
+
+    person = plan = activity = leg = route = None
+    keep_plan = False
+    # Element receiving the <attribute> values currently parsed
+    attributes_owner = None
+    person_id = None
+    plan_id = activity_id = leg_id = route_id = 0
+    skipped = {'freight persons': 0, 'unselected plans': 0, 'plans with skipped activity types': 0}
+
+    with xopen.xopen(plans_file, 'rb') as stream:
+        context = ET.iterparse(stream, events=('start', 'end'))
+        _, root = next(context)
+
+        for xml_event, elem in context:
+            tag = elem.tag
+
+            if xml_event == 'start':
+                if tag == 'person':
+                    person_id = elem.attrib['id']
+                    person = {'id': person_id}
+                    attributes_owner = person
+
+                elif tag == 'plan':
+                    plan_id += 1
+                    keep_plan = not (skip_freight and _is_freight(person))
+                    if selected_plans_only and elem.attrib.get('selected') == 'no':
+                        keep_plan = False
+                        skipped['unselected plans'] += 1
+                    plan = {'id': plan_id, 'person_id': person_id, **elem.attrib} if keep_plan else None
+                    plan_rows = {table: [] for table in ('activities', 'legs', 'routes')}
+                    attributes_owner = plan
+
+                elif tag == 'activity':
+                    activity_id += 1
+                    if keep_plan:
+                        activity = {'id': activity_id, 'plan_id': plan_id, **elem.attrib}
+                        attributes_owner = activity
+
+                elif tag == 'leg':
+                    leg_id += 1
+                    if keep_plan:
+                        leg = {'id': leg_id, 'plan_id': plan_id, **elem.attrib}
+                        attributes_owner = leg
+
+                elif tag == 'route':
+                    route_id += 1
+                    if keep_plan:
+                        route = {'id': route_id, 'leg_id': leg_id, 'value': None, **elem.attrib}
+
+            else:
+                if tag == 'attribute':
+                    if attributes_owner is not None:
+                        attributes_owner[elem.attrib['name']] = elem.text
+
+                elif not keep_plan and tag in ('route', 'activity', 'leg', 'plan'):
+                    attributes_owner = person if tag == 'plan' else None
+
+                elif tag == 'route':
+                    route['value'] = elem.text
+                    plan_rows['routes'].append(route)
+
+                elif tag == 'activity':
+                    plan_rows['activities'].append(activity)
+                    if activity.get('type') in skip_plans_with_activity_types:
+                        keep_plan = False
+                        skipped['plans with skipped activity types'] += 1
+                    attributes_owner = plan
+
+                elif tag == 'leg':
+                    plan_rows['legs'].append(leg)
+                    attributes_owner = plan
+
+                elif tag == 'plan':
+                    # Only reached for the kept plans
+                    person_rows['plans'].append(plan)
+                    for table, rows in plan_rows.items():
+                        person_rows[table].extend(rows)
+                    attributes_owner = person
+
+                elif tag == 'person':
+                    if skip_freight and _is_freight(person):
+                        skipped['freight persons'] += 1
+                    else:
+                        person_rows['persons'].append(person)
+                        for table, rows in person_rows.items():
+                            if table in writers:
+                                for row in rows:
+                                    writers[table].append(row)
+                    person_rows = {table: [] for table in BASE_COLUMNS}
+                    attributes_owner = None
+                    # Free the parsed person, otherwise the whole tree is kept in memory
+                    root.clear()
+
+    rows_written = {table: writer.close() for table, writer in writers.items()}
+    logging.info(f"Plans streamed from {plans_file}: {rows_written}, skipped {skipped}")
+    return rows_written
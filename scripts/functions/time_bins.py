@@ -0,0 +1,78 @@
+"""
+Vectorized parsing of MATSim "HH:MM:SS" times into seconds, and binning of the seconds.
+
+The hours are not limited to 24: MATSim writes the times after midnight as 24:15:00, 25:00:00, ...
+The times are kept as seconds since the start of the simulated day (NaN when missing), and the bins are
+codes (seconds // bin size) which are turned into "HH:MM:SS" labels only for the output tables.
+"""
+import numpy as np
+import pandas as pd
+
+TIME_BIN_SIZE = 30 * 60
+
+
+def parse_times(times):
+    """
+    Seconds (float) of a column of "HH:MM:SS" strings (or of seconds already), NaN where the value
+    is missing or cannot be parsed, so that the missing times propagate through the arithmetic.
+    """
+    times = pd.Series(times).reset_index(drop=True)
+    if pd.api.types.is_numeric_dtype(times.dtype):
+        return times.to_numpy(dtype=float, na_value=np.nan)
+
+    seconds = np.full(len(times), np.nan)
+    present = times.notna().to_numpy()
+    if not present.any():
+        return seconds
+    values = times[present].astype(str).to_numpy()
+
+    # Fast path: every value has the fixed width "HH:MM:SS", read as digits from the bytes
+    try:
+        encoded = values.astype('S')
+    except UnicodeEncodeError:
+        encoded = values.astype('U')
+    if encoded.dtype.kind == 'S' and encoded.dtype.itemsize == 8:
+        chars = encoded.view(np.uint8).reshape(-1, 8).astype(np.int64)
+        digits = chars[:, [0, 1, 3, 4, 6, 7]] - ord('0')
+        if ((chars[:, [2, 5]] == ord(':')).all() and ((digits >= 0) & (digits <= 9)).all()):
+            seconds[present] = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+                                (digits[:, 2] * 10 + digits[:, 3]) * 60 +
+                                digits[:, 4] * 10 + digits[:, 5])
+            return seconds
+
+    # Other widths (e.g. 100:00:00 or 7:15:00) or invalid values
+    seconds[present] = pd.to_timedelta(pd.Series(values), errors='coerce').dt.total_seconds().to_numpy()
+    return seconds
+
+
+def integer_seconds(seconds):
+    """Nullable integer (Int64) column of the seconds, <NA> for the missing times."""
+    seconds = np.floor(np.asarray(seconds, dtype=float))
+    return pd.array(seconds, dtype='Float64').astype('Int64')
+
+
+def to_timedelta(seconds):
+    """Timedelta column of the seconds, NaT for the missing times."""
+    return pd.to_timedelta(np.asarray(seconds, dtype=float), unit='s')
+
+
+def time_bins(seconds, bin_size=TIME_BIN_SIZE):
+    """Bin code of each time in seconds (seconds // bin size), NaN for the missing times."""
+    return np.floor_divide(np.asarray(seconds, dtype=float), bin_size)
+
+
+def bin_labels(bins, bin_size=TIME_BIN_SIZE):
+    """"HH:MM:SS" start time of each bin (hours can be 24 and more), None for the missing times."""
+    bins = np.asarray(bins, dtype=float)
+    labels = np.full(len(bins), None, dtype=object)
+    present = ~np.isnan(bins)
+    codes, inverse = np.unique(bins[present].astype(np.int64), return_inverse=True)
+    code_labels = np.array([f"{code * bin_size // 3600:02d}:{code * bin_size % 3600 // 60:02d}:{code * bin_size % 60:02d}"
+                            for code in codes], dtype=object)
+    labels[present] = code_labels[inverse.reshape(-1)] if len(codes) else []
+    return labels
+
+
+def binned_times(times, bin_size=TIME_BIN_SIZE):
+    """Labels of the bins of a column of times ("HH:MM:SS" strings or seconds)."""
+    return bin_labels(time_bins(parse_times(times), bin_size), bin_size)
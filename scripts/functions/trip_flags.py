@@ -0,0 +1,105 @@
+"""
+Bit flags marking which of the stage 04 subsets a trip or a person belongs to.
+
+With trip_flags = True in the [config] section of config.ini, stage 04 writes one trips table
+(trips_flagged_sim.csv) and one persons table (persons_flagged_sim.csv) with a flags column,
+instead of the four trips files and the two population files that repeat most of the rows:
+    O_AND_D                       trips_inside_O_and_D_sim (origin and destination inside)
+    O_OR_D                        trips_inside_O_or_D_sim (origin or destination inside)
+    ALL_ACTIVITIES_INSIDE         trips_all_activities_inside_sim, population_all_activities_inside_sim
+    AT_LEAST_ONE_ACTIVITY_INSIDE  trips_at_least_one_activity_inside_sim, population_at_least_one_activity_inside_sim
+    HOME_INSIDE                   trips_population_home_inside_sim, population_home_inside_sim (with home_inside_filter)
+05_1 writes the clean trips the same way. The later stages (07, 08, 05_2) select the subsets by mask with read_subset.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from functions.commonFunctions import load_config
+from functions.intermediate_store import read_table, read_table_chunks, table_path
+
+O_AND_D = 1
+O_OR_D = 2
+ALL_ACTIVITIES_INSIDE = 4
+AT_LEAST_ONE_ACTIVITY_INSIDE = 8
+HOME_INSIDE = 16
+
+FLAGS_COLUMN = 'flags'
+FLAGGED_TRIPS = 'trips_flagged_sim.csv'
+FLAGGED_PERSONS = 'persons_flagged_sim.csv'
+
+# Subset file name -> flagged table and flag it is selected with
+SUBSETS = {
+    'trips_inside_O_and_D_sim.csv': (FLAGGED_TRIPS, O_AND_D),
+    'trips_inside_O_or_D_sim.csv': (FLAGGED_TRIPS, O_OR_D),
+    'trips_all_activities_inside_sim.csv': (FLAGGED_TRIPS, ALL_ACTIVITIES_INSIDE),
+    'trips_at_least_one_activity_inside_sim.csv': (FLAGGED_TRIPS, AT_LEAST_ONE_ACTIVITY_INSIDE),
+    'population_all_activities_inside_sim.csv': (FLAGGED_PERSONS, ALL_ACTIVITIES_INSIDE),
+    'population_at_least_one_activity_inside_sim.csv': (FLAGGED_PERSONS, AT_LEAST_ONE_ACTIVITY_INSIDE),
+    'trips_population_home_inside_sim.csv': (FLAGGED_TRIPS, HOME_INSIDE),
+    'population_home_inside_sim.csv': (FLAGGED_PERSONS, HOME_INSIDE),
+}
+
+
+@lru_cache(maxsize=None)
+def use_trip_flags():
+    return load_config().getboolean('config', 'trip_flags', fallback=False)
+
+
+def to_flags(masks):
+    """Flags column from a dict {flag: boolean mask}, the masks having all the same length."""
+    flags = None
+    for flag, mask in masks.items():
+        bits = np.where(np.asarray(mask, dtype=bool), flag, 0).astype(np.uint8)
+        flags = bits if flags is None else flags | bits
+    return flags
+
+
+def select_flagged(df, flag):
+    """Rows of a flagged table having the flag, without the flags column."""
+    return df[(df[FLAGS_COLUMN].to_numpy() & flag) != 0].drop(columns=FLAGS_COLUMN).reset_index(drop=True)
+
+
+def flagged_source(file_path):
+    """Flagged table path and flag of a subset table with trip_flags, None if the subset is read as it is."""
+    folder, file_name = os.path.split(file_path)
+    if use_trip_flags() and file_name in SUBSETS:
+        flagged_name, flag = SUBSETS[file_name]
+        flagged_path = os.path.join(folder, flagged_name)
+        if os.path.exists(table_path(flagged_path)) or os.path.exists(table_path(flagged_path, 'csv')):
+            return flagged_path, flag
+    return None
+
+
+def read_subset(file_path, nrows=None):
+    """
+    Read one of the subset tables of SUBSETS (any other table is read as it is), optionally its first nrows rows.
+    With trip_flags, the subset is selected from the flagged table of the same folder, if it was written.
+    """
+    source = flagged_source(file_path)
+    if source is None:
+        return read_table(file_path, nrows=nrows)
+    flagged_path, flag = source
+    df = select_flagged(read_table(flagged_path), flag)
+    return df if nrows is None else df.iloc[:nrows]
+
+
+def read_subset_chunks(file_path, chunk_size, columns=None, nrows=None):
+    """Same as read_subset, chunk_size rows of the (flagged) table at a time, see read_table_chunks."""
+    source = flagged_source(file_path)
+    if source is None:
+        yield from read_table_chunks(file_path, chunk_size, columns=columns, nrows=nrows)
+        return
+    flagged_path, flag = source
+    remaining = nrows
+    for chunk in read_table_chunks(flagged_path, chunk_size,
+                                   columns=None if columns is None else list(columns) + [FLAGS_COLUMN]):
+        chunk[FLAGS_COLUMN] = chunk[FLAGS_COLUMN].astype(np.int64)
+        chunk = select_flagged(chunk, flag)
+        if remaining is not None:
+            chunk = chunk.iloc[:remaining]
+            remaining -= len(chunk)
+        yield chunk
+        if remaining is not None and remaining <= 0:
+            return
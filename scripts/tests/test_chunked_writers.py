@@ -0,0 +1,67 @@
+"""
+The chunked writers of functions/intermediate_store.py keep the columns first found after the first chunk.
+
+Run from the repository root with: python -m pytest scripts/tests
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from functions.intermediate_store import open_chunked_writer, read_table  # noqa: E402
+
+# Activities as streamed from a plans file: max_dur and end_time only appear after the first rows
+ROWS = [
+    {'id': 1, 'plan_id': 1, 'type': 'home', 'x': '1.5'},
+    {'id': 2, 'plan_id': 1, 'type': 'work', 'x': '2'},
+    {'id': 3, 'plan_id': 1, 'type': 'shop', 'max_dur': '01:00:00'},
+    {'id': 4, 'plan_id': 2, 'type': 'home', 'x': '3'},
+    {'id': 5, 'plan_id': 2, 'type': 'leisure', 'end_time': '08:00:00'},
+]
+
+
+def write_rows(file_path, chunk_size, fmt):
+    writer = open_chunked_writer(file_path, chunk_size, base_columns=['id', 'plan_id'], fmt=fmt)
+    for row in ROWS:
+        writer.append(row)
+    return writer.close()
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_columns_found_after_the_first_chunk_are_kept(tmp_path, fmt):
+    file_path = str(tmp_path / 'activities.csv')
+    assert write_rows(file_path, chunk_size=2, fmt=fmt) == len(ROWS)
+
+    df = read_table(file_path, fmt=fmt)
+    assert list(df.columns) == ['id', 'plan_id', 'type', 'x', 'max_dur', 'end_time']
+    assert df.loc[df['id'] == 3, 'max_dur'].item() == '01:00:00'
+    assert df.loc[df['id'] == 5, 'end_time'].item() == '08:00:00'
+    assert df['max_dur'].isna().sum() == len(ROWS) - 1
+    # No part or temporary file is left next to the table
+    assert sorted(os.listdir(tmp_path)) == [f'activities.{fmt}']
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_output_does_not_depend_on_the_chunk_size(tmp_path, fmt):
+    small_chunks = str(tmp_path / 'small.csv')
+    one_chunk = str(tmp_path / 'one.csv')
+    write_rows(small_chunks, chunk_size=2, fmt=fmt)
+    write_rows(one_chunk, chunk_size=100, fmt=fmt)
+    pd.testing.assert_frame_equal(read_table(small_chunks, fmt=fmt), read_table(one_chunk, fmt=fmt))
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_append_dataframe_with_new_columns(tmp_path, fmt):
+    file_path = str(tmp_path / 'trips.csv')
+    writer = open_chunked_writer(file_path, 2, fmt=fmt)
+    writer.append_dataframe(pd.DataFrame({'person': ['1', '2'], 'mode': ['car', 'walk']}))
+    writer.append_dataframe(pd.DataFrame({'person': ['3'], 'mode': ['pt'], 'distance': [10.5]}))
+    assert writer.close() == 3
+
+    df = read_table(file_path, fmt=fmt)
+    assert list(df.columns) == ['person', 'mode', 'distance']
+    assert df['distance'].isna().tolist() == [True, True, False]
@@ -0,0 +1,84 @@
+"""
+Regression check of single_home_persons (05_1) against the groupby(...).filter(...) it replaced.
+
+Run from the repository root with: python -m pytest scripts/tests
+"""
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+
+
+def load_stage_05_1():
+    spec = importlib.util.spec_from_file_location(
+        'generate_clean_csv_files', os.path.join(SCRIPTS_DIR, '05_1_generate_clean_csv_files.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+stage_05_1 = load_stage_05_1()
+
+
+def old_single_home_persons(df_activity):
+    """The persons kept by the previous groupby(...).filter(...) of process_activity_and_legs_data."""
+    single_home = df_activity.groupby('person_id').filter(lambda x: len(x) == 1 and x['type'].eq('Home').all())
+    return set(single_home['person_id'])
+
+
+def old_process_activity_and_legs_data(df_activity, df_legs, values_to_remove, modes_to_remove):
+    """Activities kept by the previous version of process_activity_and_legs_data (the legs filter is unchanged)."""
+    initial_single_home = df_activity.groupby('person_id').filter(lambda x: len(x) == 1 and x['type'].eq('Home').all())
+    df_activity_filtered = df_activity[~df_activity['type'].isin(values_to_remove)]
+    plan_ids_to_remove = df_activity_filtered[df_activity_filtered['type'] == 'outside']['plan_id'].unique()
+    df_activity_filtered = df_activity_filtered[~df_activity_filtered['plan_id'].isin(plan_ids_to_remove)]
+    df_activity_filtered = df_activity_filtered[~df_activity_filtered['type'].isin(['outside'])]
+    final_single_home = df_activity_filtered.groupby('person_id').filter(
+        lambda x: len(x) == 1 and x['type'].eq('Home').all())
+    final_single_home = final_single_home[~final_single_home['person_id'].isin(initial_single_home['person_id'])]
+    return df_activity_filtered[~df_activity_filtered['person_id'].isin(final_single_home['person_id'])]
+
+
+# Persons with 0 home activities (1, 5), 1 home activity (2, 3, 6, 8) and 2 or more (4, 7)
+FIXTURE = pd.DataFrame({
+    'person_id': [1, 1, 2, 3, 3, 4, 4, 4, 5, 6, 6, 7, 7, 8],
+    'type': ['work', 'shop', 'Home', 'Home', 'work', 'Home', 'Home', 'Home', 'leisure', 'Home', 'freight',
+             'Home', 'Home', 'Home'],
+})
+
+
+@pytest.mark.parametrize('person_ids', [
+    FIXTURE['person_id'],
+    FIXTURE['person_id'].astype(str),
+    FIXTURE['person_id'].astype(float).where(FIXTURE['person_id'] != 5),
+])
+def test_single_home_persons_matches_groupby_filter(person_ids):
+    df_activity = FIXTURE.assign(person_id=person_ids)
+    assert set(stage_05_1.single_home_persons(df_activity)) == old_single_home_persons(df_activity)
+
+
+def test_single_home_persons_fixture():
+    # Only the person with a single activity, of type 'Home'
+    assert list(stage_05_1.single_home_persons(FIXTURE)) == [2, 8]
+
+
+def test_process_activity_and_legs_data_matches_previous_output():
+    rng = np.random.default_rng(16)
+    n = 2000
+    df_activity = pd.DataFrame({
+        'person_id': rng.integers(0, 400, n),
+        'type': rng.choice(['Home', 'work', 'shop', 'freight', 'leisure', 'outside'], n, p=[.4, .2, .15, .15, .08, .02]),
+    })
+    df_activity = pd.concat([df_activity, FIXTURE.assign(person_id=FIXTURE['person_id'] + 1000)], ignore_index=True)
+    df_activity['plan_id'] = df_activity['person_id']
+    df_legs = pd.DataFrame({'person_id': [1], 'main_mode': ['car']})
+
+    expected = old_process_activity_and_legs_data(df_activity, df_legs, ['freight'], ['truck'])
+    result, _ = stage_05_1.process_activity_and_legs_data(df_activity, df_legs, ['freight'], ['truck'])
+    pd.testing.assert_frame_equal(result, expected)